@@ -0,0 +1,646 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Must be set before pygame is initialized by the visualizer import.
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import numpy as np
+
+from liquiprism import FacePosition, Liquiprism, count_alive_neighbors
+from rules import CONVENTIONAL, STOCHASTIC, FaceRules, rule_codes
+from sonifier import Sonifier
+
+SEED = 0
+SIZES = (7, 30, 100, 500, 1000, 2000)
+QUICK_SIZES = (7, 30)
+# Largest size each engine is benchmarked at, the per-cell reference engine
+# and the unpacked engines run out of time or memory long before 2000.
+MAX_SIZES = {
+    "cells": 100,
+    "numpy": 1000,
+    "bitpacked": 2000,
+    "sharded": 1000,
+    "frontier": 2000,
+}
+SONIFIER_SIZES = (7, 30, 100)
+VOLUME_SIZES = (16, 64, 128, 256)
+RENDER_SIZES = (7, 30, 100)
+REGIMES = ("stochastic", "conventional")
+MIN_TIME = 1.0  # seconds each benchmark runs for, at least one iteration
+EQUIVALENCE_STEPS = 60
+# Steps checked per size. 45 has more than LOOKUP_CELLS cells, so the
+# rule_terms comparisons are checked as well as the table lookups.
+EQUIVALENCE_SIZES = {7: EQUIVALENCE_STEPS, 12: EQUIVALENCE_STEPS, 45: 12}
+# Step after which a block of cells is written through the faces' cell
+# views, as a caller editing the prism between steps would.
+EDITED_STEP = 5
+EDITED_BLOCK = 4
+# Also checked with per face rules, covering other neighbor counts and both
+# certain and drawn outcomes.
+EQUIVALENCE_RULES = {
+    FacePosition.TOP: FaceRules(birth=frozenset({3, 6})),
+    FacePosition.LEFT: FaceRules(stochastic_birth=0.6, stimulus=0.5),
+    FacePosition.BACK: FaceRules(
+        survival=frozenset({1, 2, 5}),
+        birth=frozenset({0, 3}),
+        stochastic_birth=0.0,
+        stimulus=1.0,
+    ),
+}
+# Rules under which every cell off the frontmost face has a certain outcome,
+# so the previous mode check can tell which table each cell followed. The
+# update rates leave some steps with no due face.
+PREVIOUS_MODE_RULES = FaceRules(stochastic_birth=1.0)
+PREVIOUS_MODE_UPDATE_RATES = (2, 2, 3, 3, 4, 6)
+TOLERANCE = 0.1
+# Modules timed in a fresh interpreter, with the optional dependencies they
+# may load on import. The others must only load on first use.
+STARTUP_MODULES = {
+    "liquiprism": (),
+    "sonifier": (),
+    "sweep": (),
+    "volume": (),
+    "offline": ("mido",),
+    "visualizer": ("pygame",),
+}
+LAZY_DEPENDENCIES = ("mido", "pygame", "rtmidi")
+
+
+class NullMidiOut:
+    def __init__(self):
+        self.sent = 0
+
+    def send(self, msg) -> None:
+        self.sent += 1
+
+    def close(self) -> None:
+        pass
+
+
+def run_for(callback, min_time: float = MIN_TIME) -> tuple[int, float]:
+    # Calls callback until min_time has been spent inside it, returning the
+    # number of calls and the time they took.
+    iterations = 0
+    elapsed = 0.0
+    while elapsed < min_time or iterations == 0:
+        elapsed += callback()
+        iterations += 1
+    return iterations, elapsed
+
+
+def timed(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def create_liquiprism(
+    engine: str, size: int, random_update_rate: bool, regime: str
+) -> Liquiprism:
+    liquiprism = Liquiprism(
+        size,
+        random_update_rate=random_update_rate,
+        engine=engine,
+        seed=SEED,
+    )
+    # Pins every non frontmost face to one rule, the stochastic rule when
+    # the threshold can never be reached and the conventional one otherwise.
+    liquiprism.CELL_STATE_CHANGE_THRESHOLD = (
+        len(FacePosition) * size**2 + 1 if regime == "stochastic" else 0
+    )
+    return liquiprism
+
+
+def bench_step(
+    engine: str,
+    size: int,
+    random_update_rate: bool,
+    regime: str,
+    min_time: float = MIN_TIME,
+) -> dict:
+    liquiprism = create_liquiprism(engine, size, random_update_rate, regime)
+    try:
+        liquiprism.step()
+        steps, elapsed = run_for(lambda: timed(liquiprism.step), min_time)
+    finally:
+        liquiprism.close()
+    return {
+        "benchmark": "step",
+        "engine": engine,
+        "size": size,
+        "random_update_rate": random_update_rate,
+        "regime": regime,
+        "iterations": steps,
+        "rate": steps / elapsed,
+        "unit": "steps/s",
+    }
+
+
+def bench_volume(
+    size: int,
+    random_update_rate: bool,
+    regime: str,
+    min_time: float = MIN_TIME,
+) -> dict:
+    from volume import VolumePrism
+
+    volume = VolumePrism(
+        size, random_update_rate=random_update_rate, seed=SEED
+    )
+    volume.CELL_STATE_CHANGE_THRESHOLD = (
+        volume.topology.n_voxels + 1 if regime == "stochastic" else 0
+    )
+    volume.step()
+    steps, elapsed = run_for(lambda: timed(volume.step), min_time)
+    return {
+        "benchmark": "step",
+        "engine": "volume",
+        "size": size,
+        "random_update_rate": random_update_rate,
+        "regime": regime,
+        "iterations": steps,
+        "rate": steps / elapsed,
+        "unit": "steps/s",
+    }
+
+
+def bench_sonifier(size: int, min_time: float = MIN_TIME) -> dict:
+    liquiprism = Liquiprism(
+        size, random_update_rate=True, engine="numpy", seed=SEED
+    )
+    midi_out = NullMidiOut()
+    sonifier = Sonifier(liquiprism, midi_out=midi_out)
+
+    def update() -> float:
+        liquiprism.step()
+        return timed(sonifier.update)
+
+    updates, elapsed = run_for(update, min_time)
+    return {
+        "benchmark": "sonifier",
+        "engine": "numpy",
+        "size": size,
+        "iterations": updates,
+        "messages": midi_out.sent,
+        "rate": midi_out.sent / elapsed,
+        "unit": "messages/s",
+        "updates_per_second": updates / elapsed,
+    }
+
+
+def bench_render(
+    size: int, rotating: bool, min_time: float = MIN_TIME
+) -> dict:
+    from visualizer import Visualizer
+
+    liquiprism = Liquiprism(
+        size, random_update_rate=True, engine="numpy", seed=SEED
+    )
+    visualizer = Visualizer(liquiprism)
+
+    def render() -> float:
+        liquiprism.step()
+        if rotating:
+            visualizer.angle_y += 0.05
+        return timed(visualizer.render)
+
+    frames, elapsed = run_for(render, min_time)
+    return {
+        "benchmark": "render",
+        "engine": "numpy",
+        "size": size,
+        "rotating": rotating,
+        "iterations": frames,
+        "rate": frames / elapsed,
+        "unit": "frames/s",
+    }
+
+
+def bench_startup(module: str, min_time: float = MIN_TIME) -> dict:
+    # Imports module in fresh interpreters, reporting the import time, the
+    # whole process time and the optional dependencies it loaded.
+    script = (
+        "import sys, time\n"
+        "start = time.perf_counter()\n"
+        f"import {module}\n"
+        "print(time.perf_counter() - start)\n"
+        "print(','.join(sorted({name.split('.')[0] for name in sys.modules}"
+        f" & {set(LAZY_DEPENDENCIES)!r})))\n"
+    )
+    environment = dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT="1")
+    process_times = []
+    loaded = []
+
+    def start() -> float:
+        process_start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=environment,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.splitlines()
+        process_times.append(time.perf_counter() - process_start)
+        loaded[:] = [name for name in output[-1].split(",") if name]
+        return float(output[-2])
+
+    imports, elapsed = run_for(start, min_time)
+    return {
+        "benchmark": "startup",
+        "module": module,
+        "iterations": imports,
+        "rate": imports / elapsed,
+        "unit": "imports/s",
+        "process_seconds": float(np.median(process_times)),
+        "loaded": loaded,
+        "headless": set(loaded) <= set(STARTUP_MODULES[module]),
+    }
+
+
+def edit_block(liquiprism: Liquiprism) -> None:
+    face = liquiprism.get_face(FacePosition.TOP)
+    for i in range(EDITED_BLOCK):
+        for j in range(EDITED_BLOCK):
+            cell = face.get_cell((i, j))
+            cell.is_alive = True
+            cell.stimulated = (i + j) % 2 == 0
+
+
+def check_equivalence(
+    engine: str,
+    size: int,
+    steps: int = EQUIVALENCE_STEPS,
+    seed: int = SEED,
+    rules: dict[FacePosition, FaceRules] | None = None,
+    activity_mode: str = "sequential",
+) -> dict:
+    # Runs engine next to the reference cells engine from the same seed and
+    # reports the first step where their states or activities differ.
+    reference = Liquiprism(
+        size,
+        random_update_rate=True,
+        engine="cells",
+        seed=seed,
+        activity_mode=activity_mode,
+    )
+    candidate = Liquiprism(
+        size,
+        random_update_rate=True,
+        engine=engine,
+        seed=seed,
+        activity_mode=activity_mode,
+    )
+    reference.set_rules(rules)
+    candidate.set_rules(rules)
+    mismatch = None
+    try:
+        for step in range(steps):
+            # Moves the frontmost face around and lowers the threshold so
+            # both the stochastic and the conventional rules are exercised.
+            face_position = FacePosition(step // 10 % len(FacePosition))
+            for liquiprism in (reference, candidate):
+                liquiprism.frontmost_face = liquiprism.get_face(face_position)
+                liquiprism.CELL_STATE_CHANGE_THRESHOLD = size**2 // (
+                    1 + step % 3
+                )
+                liquiprism.step()
+                if step == EDITED_STEP:
+                    edit_block(liquiprism)
+
+            if reference.activity != candidate.activity:
+                mismatch = f"activity differs at step {step}"
+            elif not np.array_equal(
+                reference.get_alive_array(), candidate.get_alive_array()
+            ):
+                mismatch = f"alive cells differ at step {step}"
+            elif not np.array_equal(
+                reference.get_stimulated_array(),
+                candidate.get_stimulated_array(),
+            ):
+                mismatch = f"stimulated cells differ at step {step}"
+            if mismatch is not None:
+                break
+    finally:
+        candidate.close()
+    return {
+        "engine": engine,
+        "size": size,
+        "steps": steps,
+        "seed": seed,
+        "rules": "legacy" if rules is None else "custom",
+        "activity_mode": activity_mode,
+        "equivalent": mismatch is None,
+        "mismatch": mismatch,
+    }
+
+
+def check_previous_mode(
+    engine: str,
+    size: int,
+    steps: int = EQUIVALENCE_STEPS,
+    seed: int = SEED,
+) -> dict:
+    # Checks that in the "previous" mode every due cell off the frontmost
+    # face follows the stochastic table while the previous step's activity
+    # is below the threshold and the conventional table once it reaches it,
+    # also right after steps where no face was due.
+    liquiprism = Liquiprism(
+        size, engine=engine, seed=seed, activity_mode="previous"
+    )
+    liquiprism.set_rules(PREVIOUS_MODE_RULES)
+    for face, update_rate in zip(liquiprism.faces, PREVIOUS_MODE_UPDATE_RATES):
+        face.update_rate = update_rate
+    faces = np.arange(len(FacePosition))[:, None, None]
+    thresholds = (1, size**2, liquiprism.topology.n_cells + 1)
+    previous_activity = busy_activity = liquiprism.activity
+    idle = False
+    exercised = set()
+    mismatch = None
+    try:
+        for step in range(steps):
+            face_position = FacePosition(step // 10 % len(FacePosition))
+            liquiprism.frontmost_face = liquiprism.get_face(face_position)
+            threshold = thresholds[step % len(thresholds)]
+            liquiprism.CELL_STATE_CHANGE_THRESHOLD = threshold
+            due = np.array(
+                [
+                    liquiprism.step_counter % face.update_rate == 0
+                    for face in liquiprism.faces
+                ]
+            )
+            checked = due.copy()
+            checked[face_position.value] = False
+
+            alive = liquiprism.get_alive_array()
+            padded = liquiprism.topology.pad(alive)
+            codes = rule_codes(
+                alive, count_alive_neighbors(padded), padded[:, 2:, 1:-1]
+            )
+            regime = (
+                STOCHASTIC if previous_activity < threshold else CONVENTIONAL
+            )
+            expected = liquiprism.rule_table[faces, regime, codes] > 0.5
+            liquiprism.step()
+
+            alive_after = liquiprism.get_alive_array()
+            if not np.array_equal(alive_after[checked], expected[checked]):
+                mismatch = f"cells differ from the table at step {step}"
+            elif liquiprism.activity != np.count_nonzero(
+                (alive_after & ~alive)[due]
+            ):
+                mismatch = f"activity differs at step {step}"
+            if mismatch is not None:
+                break
+            # After a step with no due face the activity is 0, so the
+            # stochastic table is back even if the last busy step's
+            # activity reached the threshold.
+            if checked.any():
+                exercised.add(REGIMES[regime])
+                if idle and busy_activity >= threshold:
+                    exercised.add("switch after idle step")
+            idle = not due.any()
+            previous_activity = liquiprism.activity
+            if not idle:
+                busy_activity = previous_activity
+    finally:
+        liquiprism.close()
+
+    missing = {*REGIMES, "switch after idle step"} - exercised
+    if mismatch is None and missing:
+        mismatch = f"never exercised {', '.join(sorted(missing))}"
+    return {
+        "engine": engine,
+        "size": size,
+        "steps": steps,
+        "seed": seed,
+        "follows_tables": mismatch is None,
+        "mismatch": mismatch,
+    }
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(
+        (key, value)
+        for key, value in sorted(result.items())
+        if key
+        not in (
+            "iterations",
+            "messages",
+            "rate",
+            "updates_per_second",
+            "process_seconds",
+            "loaded",
+            "headless",
+        )
+    )
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float):
+    # Adds the speedup over the matching baseline result, rates below
+    # 1 - tolerance of the baseline are flagged as regressions.
+    baseline_rates = {
+        result_key(result): result["rate"] for result in baseline
+    }
+    regressions = []
+    for result in results:
+        baseline_rate = baseline_rates.get(result_key(result))
+        if baseline_rate is None:
+            continue
+        result["baseline_rate"] = baseline_rate
+        result["speedup"] = result["rate"] / baseline_rate
+        if result["speedup"] < 1 - tolerance:
+            regressions.append(result)
+    return regressions
+
+
+def describe(result: dict) -> str:
+    if result["benchmark"] == "startup":
+        labels = ["startup", result["module"]]
+    else:
+        labels = [
+            result["benchmark"],
+            result["engine"],
+            f"size={result['size']}",
+        ]
+    if "regime" in result:
+        labels.append(result["regime"])
+        labels.append(
+            "random rates" if result["random_update_rate"] else "fixed rates"
+        )
+    if result.get("rotating"):
+        labels.append("rotating")
+    line = f"{' '.join(labels):<50}{result['rate']:12.1f} {result['unit']}"
+    if "speedup" in result:
+        line += f"  x{result['speedup']:.2f}"
+    return line
+
+
+def run(
+    engines: tuple[str] = Liquiprism.ENGINES,
+    sizes: tuple[int] = SIZES,
+    min_time: float = MIN_TIME,
+) -> dict:
+    results = []
+    for engine in engines:
+        for size in sizes:
+            if size > MAX_SIZES[engine]:
+                continue
+            for random_update_rate in (False, True):
+                for regime in REGIMES:
+                    results.append(
+                        bench_step(
+                            engine, size, random_update_rate, regime, min_time
+                        )
+                    )
+                    print(describe(results[-1]), flush=True)
+
+    for size in VOLUME_SIZES:
+        if size > max(sizes):
+            continue
+        for random_update_rate in (False, True):
+            for regime in REGIMES:
+                results.append(
+                    bench_volume(size, random_update_rate, regime, min_time)
+                )
+                print(describe(results[-1]), flush=True)
+
+    for size in SONIFIER_SIZES:
+        if size > max(sizes):
+            continue
+        results.append(bench_sonifier(size, min_time))
+        print(describe(results[-1]), flush=True)
+
+    for size in RENDER_SIZES:
+        if size > max(sizes):
+            continue
+        for rotating in (False, True):
+            results.append(bench_render(size, rotating, min_time))
+            print(describe(results[-1]), flush=True)
+
+    for module in STARTUP_MODULES:
+        results.append(bench_startup(module, min_time))
+        print(describe(results[-1]), flush=True)
+        if not results[-1]["headless"]:
+            print(
+                f"startup {module} loads {results[-1]['loaded']} on import",
+                flush=True,
+            )
+
+    equivalence = [
+        check_equivalence(
+            engine, size, steps, rules=rules, activity_mode=activity_mode
+        )
+        for engine in engines
+        if engine != "cells"
+        for size, steps in EQUIVALENCE_SIZES.items()
+        for rules in (None, EQUIVALENCE_RULES)
+        for activity_mode in Liquiprism.ACTIVITY_MODES
+    ]
+    for check in equivalence:
+        print(
+            f"equivalence {check['engine']} size={check['size']} "
+            f"{check['rules']} rules {check['activity_mode']}: "
+            + ("ok" if check["equivalent"] else check["mismatch"]),
+            flush=True,
+        )
+
+    previous_mode = [
+        check_previous_mode(engine, size, steps)
+        for engine in engines
+        for size, steps in EQUIVALENCE_SIZES.items()
+    ]
+    for check in previous_mode:
+        print(
+            f"previous mode {check['engine']} size={check['size']}: "
+            + ("ok" if check["follows_tables"] else check["mismatch"]),
+            flush=True,
+        )
+
+    return {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "results": results,
+        "equivalence": equivalence,
+        "previous_mode": previous_mode,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the engines, the sonifier and the renderer."
+    )
+    parser.add_argument(
+        "--output", default="benchmark.json", help="JSON file for the results"
+    )
+    parser.add_argument(
+        "--baseline", default=None, help="JSON results to compare against"
+    )
+    parser.add_argument(
+        "--engines",
+        nargs="+",
+        default=list(Liquiprism.ENGINES),
+        choices=Liquiprism.ENGINES,
+    )
+    parser.add_argument("--sizes", nargs="+", type=int, default=None)
+    parser.add_argument(
+        "--quick", action="store_true", help=f"only sizes {QUICK_SIZES}"
+    )
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=MIN_TIME,
+        help="seconds per benchmark",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=TOLERANCE,
+        help="slowdown over the baseline reported as a regression",
+    )
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else SIZES)
+    report = run(tuple(args.engines), tuple(sizes), args.min_time)
+
+    failed = (
+        not all(check["equivalent"] for check in report["equivalence"])
+        or not all(
+            check["follows_tables"] for check in report["previous_mode"]
+        )
+        or not all(
+            result["headless"]
+            for result in report["results"]
+            if result["benchmark"] == "startup"
+        )
+    )
+    if args.baseline is not None:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(report["results"], baseline, args.tolerance)
+        print(f"\ncompared with {args.baseline}:")
+        for result in report["results"]:
+            if "speedup" in result:
+                print(describe(result))
+        for result in regressions:
+            print(f"regression: {describe(result)}")
+        failed = failed or bool(regressions)
+
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,327 @@
+import numpy as np
+
+from liquiprism import FACE_MAP, FacePosition, RelativeFacePosition
+from rng import PrismRNG
+from rules import (
+    LEGACY_TABLE,
+    MAX_NEIGHBORS,
+    regime_tables,
+    row_runs,
+    rule_terms,
+)
+
+WORD_BITS = 64
+
+SEAM_FACES = {
+    relative_position: np.array(
+        [
+            FACE_MAP[position][relative_position].value
+            for position in FacePosition
+        ]
+    )
+    for relative_position in RelativeFacePosition
+}
+
+
+def n_words(size: int) -> int:
+    # Column j is stored at bit j + 1, bits 0 and size + 1 are left free for
+    # the seam columns of the left and right faces.
+    return (size + 2 + WORD_BITS - 1) // WORD_BITS
+
+
+def pack_rows(bits: np.ndarray) -> np.ndarray:
+    size = bits.shape[-1]
+    padded = np.zeros(
+        bits.shape[:-1] + (n_words(size) * WORD_BITS,), dtype=bool
+    )
+    padded[..., 1 : size + 1] = bits
+    return (
+        np.packbits(padded, axis=-1, bitorder="little")
+        .view("<u8")
+        .astype(np.uint64, copy=False)
+    )
+
+
+def unpack_rows(words: np.ndarray, size: int) -> np.ndarray:
+    bits = np.unpackbits(
+        np.ascontiguousarray(words, dtype="<u8").view(np.uint8),
+        axis=-1,
+        bitorder="little",
+    )
+    return bits[..., 1 : size + 1].astype(bool)
+
+
+def set_cells(words: np.ndarray, size: int) -> np.ndarray:
+    # Sorted flat indices of the set cells of (6, size, n_words) rows, only
+    # the rows with a set bit are unpacked.
+    rows = words.reshape(-1, words.shape[-1])
+    set_rows = np.flatnonzero(rows.any(axis=-1))
+    row_indices, columns = np.nonzero(unpack_rows(rows[set_rows], size))
+    return set_rows[row_indices] * size + columns
+
+
+def get_bits(words: np.ndarray, bit: int) -> np.ndarray:
+    return (words[..., bit // WORD_BITS] >> np.uint64(bit % WORD_BITS)) & (
+        np.uint64(1)
+    )
+
+
+def shift_up(words: np.ndarray) -> np.ndarray:
+    # Moves every bit one column to the right, so each cell sees the value
+    # of its left neighbor.
+    shifted = words << np.uint64(1)
+    shifted[..., 1:] |= words[..., :-1] >> np.uint64(WORD_BITS - 1)
+    return shifted
+
+
+def shift_down(words: np.ndarray) -> np.ndarray:
+    # Moves every bit one column to the left, so each cell sees the value of
+    # its right neighbor.
+    shifted = words >> np.uint64(1)
+    shifted[..., :-1] |= words[..., 1:] << np.uint64(WORD_BITS - 1)
+    return shifted
+
+
+def add_bit_planes(planes: list[np.ndarray]) -> list[np.ndarray]:
+    # Bit-sliced ripple-carry sum, counts[k] holds bit k of every cell's count.
+    counts = [np.zeros_like(planes[0]) for _ in range(4)]
+    for plane in planes:
+        carry = plane
+        for k in range(len(counts)):
+            counts[k], carry = counts[k] ^ carry, counts[k] & carry
+    return counts
+
+
+def count_set_mask(
+    counts: list[np.ndarray], count_set: frozenset[int], bit: int = 4, low=0
+):
+    # Words marking the cells whose neighbor count is in count_set, found by
+    # splitting on the count bits from the highest one. Returns None for no
+    # cell and True for every cell; counts above MAX_NEIGHBORS never occur.
+    possible = set(range(low, min(low + 2**bit, MAX_NEIGHBORS + 1)))
+    if possible <= count_set:
+        return True
+    if not possible & count_set:
+        return None
+
+    bit -= 1
+    clear = count_set_mask(counts, count_set, bit, low)
+    set_ = count_set_mask(counts, count_set, bit, low + 2**bit)
+    if clear is None:
+        return counts[bit] if set_ is True else counts[bit] & set_
+    if set_ is None:
+        return ~counts[bit] if clear is True else ~counts[bit] & clear
+    clear = ~counts[bit] if clear is True else ~counts[bit] & clear
+    return clear | (counts[bit] if set_ is True else counts[bit] & set_)
+
+
+class PackedGrid:
+    def __init__(self, size: int, words: np.ndarray | None = None):
+        self.size = size
+        self.words = (
+            words
+            if words is not None
+            else np.zeros(
+                (len(FacePosition), size, n_words(size)), dtype=np.uint64
+            )
+        )
+
+    @classmethod
+    def from_array(cls, cells: np.ndarray) -> "PackedGrid":
+        return cls(cells.shape[-1], pack_rows(cells))
+
+    @classmethod
+    def random(
+        cls, size: int, rng: PrismRNG, probability: float = 0.5
+    ) -> "PackedGrid":
+        grid = cls(size)
+        for face_index in range(len(FacePosition)):
+            grid.words[face_index] = pack_rows(
+                rng.uniforms(face_index, (size, size)) < probability
+            )
+        return grid
+
+    def to_array(self) -> np.ndarray:
+        return unpack_rows(self.words, self.size)
+
+    def __getitem__(self, index: tuple[int]) -> bool:
+        face_index, i, j = index
+        return bool(get_bits(self.words[face_index, i], j + 1))
+
+    def __setitem__(self, index: tuple[int], value: bool) -> None:
+        face_index, i, j = index
+        word, bit = divmod(j + 1, WORD_BITS)
+        mask = np.uint64(1) << np.uint64(bit)
+        if value:
+            self.words[face_index, i, word] |= mask
+        else:
+            self.words[face_index, i, word] &= ~mask
+
+
+class PackedState:
+    def __init__(
+        self, alive: PackedGrid, update_rates: np.ndarray, rng: PrismRNG
+    ):
+        self.size = alive.size
+        self.rng = rng
+        self.alive = alive
+        self.will_be_alive = PackedGrid(self.size)
+        self.stimulated = PackedGrid(self.size)
+        self.update_rates = update_rates
+        self.column_mask = pack_rows(np.ones(self.size, dtype=bool))
+
+    def pad(self, words: np.ndarray) -> np.ndarray:
+        padded = np.empty(
+            (len(FacePosition), self.size + 2, words.shape[-1]),
+            dtype=np.uint64,
+        )
+        padded[:, 1:-1] = words
+        padded[:, 0] = words[SEAM_FACES[RelativeFacePosition.TOP], -1]
+        padded[:, -1] = words[SEAM_FACES[RelativeFacePosition.BOTTOM], 0]
+
+        left_column = get_bits(words, self.size)
+        right_column = get_bits(words, 1)
+        padded[:, 1:-1, 0] |= left_column[
+            SEAM_FACES[RelativeFacePosition.LEFT]
+        ]
+        padded[:, 1:-1, (self.size + 1) // WORD_BITS] |= right_column[
+            SEAM_FACES[RelativeFacePosition.RIGHT]
+        ] << np.uint64((self.size + 1) % WORD_BITS)
+        return padded
+
+    def count_alive_neighbors(self, padded: np.ndarray) -> list[np.ndarray]:
+        above, middle, below = padded[:, :-2], padded[:, 1:-1], padded[:, 2:]
+        return add_bit_planes(
+            [
+                shift_up(above),
+                above,
+                shift_down(above),
+                shift_up(middle),
+                shift_down(middle),
+                shift_up(below),
+                below,
+                shift_down(below),
+            ]
+        )
+
+    def draw(
+        self, due: np.ndarray, probabilities: list[set[float]]
+    ) -> dict[float, np.ndarray]:
+        # Packed uniforms < probability for each probability a face needs,
+        # left empty on the other faces.
+        draws = {
+            probability: np.zeros(self.alive.words.shape, dtype=np.uint64)
+            for probability in set().union(*probabilities)
+        }
+        for face_index in np.flatnonzero(due):
+            uniforms = self.rng.uniforms(face_index, (self.size, self.size))
+            for probability in probabilities[face_index]:
+                draws[probability][face_index] = pack_rows(
+                    uniforms < probability
+                )
+        return draws
+
+    def apply_table(
+        self,
+        table: np.ndarray,
+        planes: tuple[np.ndarray],
+        draws: dict[float, np.ndarray],
+    ) -> np.ndarray:
+        # Evaluates a (6, N_CODES) table with bitwise operations, faces
+        # sharing a row of the table are evaluated together.
+        alive, bellow_alive, counts = planes
+        result = np.zeros(alive.shape, dtype=np.uint64)
+        for row, faces in row_runs(table):
+            states = {True: alive[faces], False: ~alive[faces]}
+            belows = {
+                None: True,
+                True: bellow_alive[faces],
+                False: ~bellow_alive[faces],
+            }
+            face_counts = [plane[faces] for plane in counts]
+            for probability, terms in rule_terms(row):
+                drawn = draws[probability][faces] if probability < 1 else True
+                for cell_alive, below, count_set in terms:
+                    # True stands for every cell, so it is never combined
+                    # with the words directly.
+                    term = states[cell_alive]
+                    for condition in (
+                        belows[below],
+                        drawn,
+                        count_set_mask(face_counts, count_set),
+                    ):
+                        if condition is not True:
+                            term = term & condition
+                    result[faces] |= term
+        return result
+
+    def conventional_mask(self, will_stimulate: np.ndarray, threshold: int):
+        # Marks every cell visited after the threshold-th stimulated cell in
+        # face by face, row-major order, or returns None if it is never hit.
+        mask = np.zeros(will_stimulate.shape, dtype=np.uint64)
+        if threshold <= 0:
+            mask[:] = self.column_mask
+            return mask
+
+        row_counts = np.bitwise_count(will_stimulate).sum(axis=-1).ravel()
+        stimulated_before = np.cumsum(row_counts)
+        if stimulated_before[-1] < threshold:
+            return None
+
+        row = int(np.searchsorted(stimulated_before, threshold))
+        face_index, i = divmod(row, self.size)
+        row_stimulated = np.flatnonzero(
+            unpack_rows(will_stimulate[face_index, i], self.size)
+        )
+        remaining = threshold - (stimulated_before[row] - row_counts[row])
+        j = row_stimulated[remaining - 1]
+
+        mask.reshape(-1, mask.shape[-1])[row + 1 :] = self.column_mask
+        after = np.zeros(self.size, dtype=bool)
+        after[j + 1 :] = True
+        mask[face_index, i] = pack_rows(after)
+        return mask
+
+    def evolve(
+        self,
+        due: np.ndarray,
+        frontmost: int,
+        threshold: int,
+        rule_table: np.ndarray = LEGACY_TABLE,
+    ) -> int:
+        alive = self.alive.words
+        padded = self.pad(alive)
+        planes = (alive, padded[:, 2:], self.count_alive_neighbors(padded))
+        primary, conventional = regime_tables(rule_table, frontmost)
+        draws = self.draw(
+            due,
+            [
+                {
+                    probability
+                    for probability in face_probabilities.tolist()
+                    if 0 < probability < 1
+                }
+                for face_probabilities in np.concatenate(
+                    [primary, conventional], axis=-1
+                )
+            ],
+        )
+
+        will_be_alive = self.will_be_alive.words
+        will_be_alive[:] = self.apply_table(primary, planes, draws)
+        will_be_alive &= self.column_mask
+        will_be_alive[~due] = 0
+        will_stimulate = will_be_alive & ~alive
+
+        is_conventional = self.conventional_mask(will_stimulate, threshold)
+        if is_conventional is not None:
+            will_be_alive[:] = (will_be_alive & ~is_conventional) | (
+                self.apply_table(conventional, planes, draws) & is_conventional
+            )
+            will_be_alive &= self.column_mask
+            will_be_alive[~due] = 0
+            will_stimulate = will_be_alive & ~alive
+
+        self.stimulated.words[due] = will_stimulate[due]
+        alive[due] = will_be_alive[due]
+        return int(np.bitwise_count(will_stimulate).sum())
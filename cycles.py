@@ -0,0 +1,154 @@
+import math
+
+import numpy as np
+
+from liquiprism import FacePosition, Liquiprism, count_alive_neighbors
+from rules import regime_tables, rule_codes
+
+ZOBRIST_SEED = 0x5EED
+MAX_HISTORY = 100_000  # states remembered while looking for a cycle
+
+
+class CycleDetector:
+    def __init__(self, liquiprism: Liquiprism):
+        self.liquiprism = liquiprism
+        self.size = liquiprism.size
+        self.cycle_length = math.lcm(
+            *(face.update_rate for face in liquiprism.faces)
+        )
+
+        shape = (len(FacePosition), self.size, self.size)
+        keys = np.random.default_rng(ZOBRIST_SEED)
+        self.alive_keys = keys.integers(0, 2**64, size=shape, dtype=np.uint64)
+        self.stimulated_keys = keys.integers(
+            0, 2**64, size=shape, dtype=np.uint64
+        )
+
+        self.alive = liquiprism.get_alive_array()
+        self.stimulated = liquiprism.get_stimulated_array()
+        self.hash = np.bitwise_xor.reduce(
+            self.alive_keys[self.alive], initial=np.uint64(0)
+        ) ^ np.bitwise_xor.reduce(
+            self.stimulated_keys[self.stimulated], initial=np.uint64(0)
+        )
+        self.history = {}
+        self.period = None
+        self.cycle_start = None
+        self.set_rules(self.current_rules())
+        self.remember()
+
+    def __repr__(self):
+        return f"CycleDetector(period={self.period})"
+
+    def current_rules(self) -> tuple:
+        return (
+            self.liquiprism.frontmost_face.position.value,
+            self.liquiprism.CELL_STATE_CHANGE_THRESHOLD,
+            self.liquiprism.activity_mode,
+            self.liquiprism.rule_table.tobytes(),
+        )
+
+    def state_key(self) -> tuple[int]:
+        # In the "previous" activity mode the rule of the next step also
+        # depends on the last activity, through the step threshold.
+        return (
+            int(self.hash),
+            self.liquiprism.step_counter % self.cycle_length,
+            self.liquiprism.step_threshold(),
+        )
+
+    def forget(self) -> None:
+        self.history.clear()
+        self.period = None
+        self.cycle_start = None
+
+    def remember(self) -> None:
+        if len(self.history) >= MAX_HISTORY:
+            self.history.clear()
+        self.history[self.state_key()] = self.liquiprism.step_counter
+
+    def set_rules(self, rules: tuple) -> None:
+        self.rules = rules
+        primary, conventional = regime_tables(
+            self.liquiprism.rule_table, rules[0]
+        )
+        # Codes whose outcome is drawn, and codes always born before the
+        # threshold is reached.
+        self.primary_drawn = (0 < primary) & (primary < 1)
+        self.primary_born = primary == 1
+        self.conventional_drawn = (0 < conventional) & (conventional < 1)
+
+    def is_deterministic(self, due: np.ndarray) -> bool:
+        # Whether the next step's outcome is independent of the random
+        # draws, that is whether every due cell follows a rule giving it a
+        # probability of 0 or 1. The conventional rule only applies once
+        # the threshold is reached, which can be told when the rule before
+        # it is certain.
+        threshold = self.liquiprism.step_threshold()
+        drawn = self.conventional_drawn
+        if threshold > 0:
+            drawn = drawn | self.primary_drawn
+        if not drawn[due].any():
+            return True
+
+        padded = self.liquiprism.topology.pad(self.alive)
+        codes = rule_codes(
+            self.alive, count_alive_neighbors(padded), padded[:, 2:, 1:-1]
+        )
+        faces = np.arange(len(FacePosition))[:, None, None]
+        due_codes = (faces[due], codes[due])
+        if threshold > 0:
+            if self.primary_drawn[due_codes].any():
+                return False
+            births = self.primary_born[due_codes] & ~self.alive[due]
+            if np.count_nonzero(births) < threshold:
+                return True
+
+        return not self.conventional_drawn[due_codes].any()
+
+    def step(self) -> int | None:
+        # Steps the prism and returns the period once the state it reached
+        # has already been seen after a run of deterministic steps.
+        due = self.liquiprism._due_faces()
+        rules = self.current_rules()
+        if rules != self.rules:
+            self.set_rules(rules)
+            self.forget()
+        elif not self.is_deterministic(due):
+            self.forget()
+
+        self.liquiprism.step()
+        alive = self.liquiprism.get_alive_array()
+        stimulated = self.liquiprism.get_stimulated_array()
+        self.hash ^= np.bitwise_xor.reduce(
+            self.alive_keys[alive != self.alive], initial=np.uint64(0)
+        ) ^ np.bitwise_xor.reduce(
+            self.stimulated_keys[stimulated != self.stimulated],
+            initial=np.uint64(0),
+        )
+        self.alive = alive
+        self.stimulated = stimulated
+
+        seen_at = self.history.get(self.state_key())
+        if seen_at is not None:
+            self.cycle_start = seen_at
+            self.period = self.liquiprism.step_counter - seen_at
+        self.remember()
+        return self.period
+
+    def fast_forward(self, cycles: int) -> None:
+        # Skips whole periods, the state is the same after each of them and
+        # the face streams are advanced by the draws they would have made.
+        if self.period is None:
+            raise RuntimeError("No cycle has been detected")
+
+        start = self.liquiprism.step_counter
+        steps = np.arange(start, start + self.period)
+        for face in self.liquiprism.faces:
+            due_steps = int(np.count_nonzero(steps % face.update_rate == 0))
+            self.liquiprism.rng.skip(
+                face.position.value, cycles * due_steps * self.size**2
+            )
+        self.liquiprism.step_counter += cycles * self.period
+        self.history.clear()
+        self.remember()
@@ -0,0 +1,138 @@
+import numpy as np
+
+from liquiprism import Face, FacePosition, FaceView, evolve, get_topology
+from rng import PrismRNG
+from rules import FaceRules, compile_rules
+
+
+class MemberState:
+    def __init__(self, ensemble: "LiquiprismEnsemble", member: int):
+        self.ensemble = ensemble
+        self.member = member
+
+    @property
+    def alive(self) -> np.ndarray:
+        return self.ensemble.alive[self.member]
+
+    @property
+    def stimulated(self) -> np.ndarray:
+        return self.ensemble.stimulated[self.member]
+
+    @property
+    def update_rates(self) -> np.ndarray:
+        return self.ensemble.update_rates[self.member]
+
+
+class EnsembleMember:
+    def __init__(self, ensemble: "LiquiprismEnsemble", member: int):
+        self.ensemble = ensemble
+        self.member = member
+        self.size = ensemble.size
+        self.engine = "numpy"
+        self.state = MemberState(ensemble, member)
+        self.faces = [
+            FaceView(state=self.state, position=position, size=self.size)
+            for position in list(FacePosition)
+        ]
+        self.topology = ensemble.topology
+
+    def __repr__(self):
+        return f"EnsembleMember(member={self.member}, size={self.size})"
+
+    @property
+    def activity(self) -> int:
+        return int(self.ensemble.activity[self.member])
+
+    @property
+    def step_counter(self) -> int:
+        return self.ensemble.step_counter
+
+    @property
+    def CELL_STATE_CHANGE_THRESHOLD(self) -> int:
+        return self.ensemble.CELL_STATE_CHANGE_THRESHOLD
+
+    @property
+    def frontmost_face(self) -> FaceView:
+        return self.faces[self.ensemble.frontmost[self.member]]
+
+    @frontmost_face.setter
+    def frontmost_face(self, face: Face) -> None:
+        self.ensemble.frontmost[self.member] = face.position.value
+
+    def get_face(self, face_position: FacePosition) -> FaceView:
+        return self.faces[face_position.value]
+
+    def get_alive_array(self) -> np.ndarray:
+        return self.state.alive.copy()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        return self.state.stimulated.copy()
+
+
+class LiquiprismEnsemble:
+    def __init__(
+        self,
+        size: int,
+        members: int,
+        random_update_rate: bool = False,
+        update_rates: np.ndarray | None = None,
+        seed: int | None = None,
+    ):
+        self.size = size
+        self.topology = get_topology(size)
+        self.rngs = [
+            PrismRNG(member_seed)
+            for member_seed in np.random.SeedSequence(seed).spawn(members)
+        ]
+
+        self.alive = np.stack([rng.initial_states(size) for rng in self.rngs])
+        self.stimulated = np.zeros_like(self.alive)
+        if update_rates is not None:
+            self.update_rates = np.broadcast_to(
+                update_rates, (members, len(FacePosition))
+            ).copy()
+        else:
+            self.update_rates = np.stack(
+                [rng.update_rates(random_update_rate) for rng in self.rngs]
+            )
+
+        self.activity = np.zeros(members, dtype=int)
+        self.frontmost = np.zeros(members, dtype=int)
+        self.CELL_STATE_CHANGE_THRESHOLD = self.size**2
+        self.set_rules(None)
+        self.step_counter = 0
+        self.members = [
+            EnsembleMember(self, member) for member in range(members)
+        ]
+
+    def __len__(self):
+        return len(self.members)
+
+    def __getitem__(self, member: int) -> EnsembleMember:
+        return self.members[member]
+
+    def set_rules(
+        self, rules: dict[FacePosition, FaceRules] | FaceRules | None
+    ) -> None:
+        # Shared by every member, faces missing from rules follow the legacy
+        # rules.
+        self.rules = rules
+        self.rule_table = compile_rules(rules)
+
+    def step(self) -> None:
+        due = self.step_counter % self.update_rates == 0
+        uniforms = np.ones(self.alive.shape)
+        for rng, member_due, member_uniforms in zip(self.rngs, due, uniforms):
+            rng.step_uniforms(member_due, self.size, out=member_uniforms)
+
+        self.activity[:] = evolve(
+            self.alive,
+            self.stimulated,
+            self.topology,
+            due=due,
+            frontmost=self.frontmost,
+            threshold=self.CELL_STATE_CHANGE_THRESHOLD,
+            uniforms=uniforms,
+            rule_table=self.rule_table,
+        )
+        self.step_counter += 1
@@ -0,0 +1,238 @@
+import socket
+import threading
+import time
+from collections import deque
+
+import mido
+
+from offline import MidiFileOutput
+
+BUFFER_SIZE = 1024  # events held per sink before its policy applies
+BLOCK_TIMEOUT = 0.01  # seconds a "block" sink may hold up the publisher
+POLICIES = ("drop_oldest", "drop_newest", "block")
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = BUFFER_SIZE, policy="drop_oldest"):
+        if policy not in POLICIES:
+            raise ValueError(
+                f"Unknown policy {policy!r}, expected one of {POLICIES}"
+            )
+
+        self.capacity = capacity
+        self.policy = policy
+        self.events = deque()
+        self.dropped = 0
+        self.closed = False
+        # When a "block" buffer started waiting for room, shared by every
+        # put until one finds room again.
+        self.block_start = None
+        self.condition = threading.Condition()
+
+    def __len__(self):
+        return len(self.events)
+
+    def put(self, event) -> bool:
+        # Returns whether the event was kept. A full buffer drops its oldest
+        # event, the new one, or waits for room and then drops the new one.
+        # Waits share one BLOCK_TIMEOUT until the sink catches up, so a slow
+        # sink holds up the publisher that long in all, not once per event.
+        with self.condition:
+            if self.closed:
+                return False
+            if len(self.events) < self.capacity:
+                self.block_start = None
+            else:
+                if self.policy == "block":
+                    if self.block_start is None:
+                        self.block_start = time.perf_counter()
+                    self.condition.wait_for(
+                        lambda: len(self.events) < self.capacity
+                        or self.closed,
+                        timeout=max(
+                            0.0,
+                            self.block_start
+                            + BLOCK_TIMEOUT
+                            - time.perf_counter(),
+                        ),
+                    )
+                if self.policy == "drop_oldest":
+                    self.events.popleft()
+                    self.dropped += 1
+                elif len(self.events) >= self.capacity or self.closed:
+                    self.dropped += 1
+                    return False
+            self.events.append(event)
+            self.condition.notify_all()
+            return True
+
+    def take(self) -> list:
+        # Waits for events and returns all of them, or an empty list once
+        # the buffer is closed and drained.
+        with self.condition:
+            self.condition.wait_for(lambda: self.events or self.closed)
+            events = list(self.events)
+            self.events.clear()
+            self.condition.notify_all()
+            return events
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class SinkWorker:
+    def __init__(
+        self, sink, policy: str = "drop_oldest", capacity: int = BUFFER_SIZE
+    ):
+        self.sink = sink
+        self.buffer = RingBuffer(capacity, policy)
+        self.delivered = 0
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def __repr__(self):
+        return (
+            f"SinkWorker(sink={self.sink!r}, delivered={self.delivered}, "
+            f"dropped={self.buffer.dropped})"
+        )
+
+    def put(self, event) -> bool:
+        return self.buffer.put(event)
+
+    def _run(self) -> None:
+        try:
+            while events := self.buffer.take():
+                for event_time, message in events:
+                    self.sink.send(message, event_time)
+                    self.delivered += 1
+        except Exception as error:
+            # A failing sink stops receiving events, the others carry on.
+            self.error = error
+            self.buffer.close()
+
+    def close(self) -> None:
+        # Delivers the events still buffered before closing the sink.
+        self.buffer.close()
+        self.thread.join()
+        self.sink.close()
+
+
+class EventBus:
+    # Stands in for a mido output, every message sent to the bus is queued
+    # for each sink and delivered by that sink's own thread.
+    def __init__(self):
+        self.workers = []
+
+    def __repr__(self):
+        return f"EventBus(workers={self.workers!r})"
+
+    def add_sink(
+        self, sink, policy: str = "drop_oldest", capacity: int = BUFFER_SIZE
+    ) -> SinkWorker:
+        worker = SinkWorker(sink, policy, capacity)
+        self.workers.append(worker)
+        return worker
+
+    def send(self, message: mido.Message) -> None:
+        event = (time.perf_counter(), message)
+        for worker in self.workers:
+            worker.put(event)
+
+    def stats(self) -> list[dict]:
+        return [
+            {
+                "sink": repr(worker.sink),
+                "delivered": worker.delivered,
+                "dropped": worker.buffer.dropped,
+                "error": worker.error,
+            }
+            for worker in self.workers
+        ]
+
+    def close(self) -> None:
+        for worker in self.workers:
+            worker.close()
+
+
+class PortSink:
+    def __init__(self, port: str | mido.ports.BaseOutput):
+        self.port = mido.open_output(port) if isinstance(port, str) else port
+
+    def __repr__(self):
+        return f"PortSink({self.port.name!r})"
+
+    def send(self, message: mido.Message, event_time: float) -> None:
+        self.port.send(message)
+
+    def close(self) -> None:
+        self.port.close()
+
+
+class MidiFileSink:
+    # Writes the events to a MIDI file at the time they were published.
+    def __init__(self, path: str, start_time: float | None = None):
+        self.path = path
+        self.start_time = (
+            start_time if start_time is not None else time.perf_counter()
+        )
+        self.output = MidiFileOutput()
+
+    def __repr__(self):
+        return f"MidiFileSink({self.path!r})"
+
+    def send(self, message: mido.Message, event_time: float) -> None:
+        self.output.current_tick = max(
+            self.output.current_tick,
+            round(
+                mido.second2tick(
+                    event_time - self.start_time,
+                    self.output.midi_file.ticks_per_beat,
+                    self.output.tempo,
+                )
+            ),
+        )
+        self.output.send(message)
+
+    def close(self) -> None:
+        self.output.save(self.path)
+
+
+class UDPSink:
+    # Sends each message's raw MIDI bytes as one datagram.
+    def __init__(self, address: tuple[str, int]):
+        self.address = address
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __repr__(self):
+        return f"UDPSink({self.address!r})"
+
+    def send(self, message: mido.Message, event_time: float) -> None:
+        self.socket.sendto(bytes(message.bytes()), self.address)
+
+    def close(self) -> None:
+        self.socket.close()
+
+
+class CollectorSink:
+    # Keeps every (time, message) event in memory.
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay  # seconds spent on each event, to mimic a slow sink
+        self.events = []
+
+    def __repr__(self):
+        return f"CollectorSink(events={len(self.events)})"
+
+    @property
+    def messages(self) -> list[mido.Message]:
+        return [message for _, message in self.events]
+
+    def send(self, message: mido.Message, event_time: float) -> None:
+        if self.delay:
+            time.sleep(self.delay)
+        self.events.append((event_time, message))
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,235 @@
+import numpy as np
+
+from liquiprism import count_alive_neighbors, get_topology
+from rng import PrismRNG
+from rules import LEGACY_TABLE, N_CODES, regime_tables, rule_codes
+
+# Above one cell in this many, sets of cells are merged through a mask over
+# the whole cube instead of by sorting.
+DENSE_RATIO = 64
+
+
+def merge_cells(cells: np.ndarray, n_cells: int) -> np.ndarray:
+    # Sorted unique flat indices of cells.
+    if len(cells) * DENSE_RATIO < n_cells:
+        cells = np.sort(cells)
+        return cells[np.append(True, cells[1:] != cells[:-1])[: len(cells)]]
+
+    mask = np.zeros(n_cells, dtype=bool)
+    mask[cells] = True
+    return np.flatnonzero(mask)
+
+
+def update_cells(
+    cells: np.ndarray, touched: np.ndarray, keep: np.ndarray, n_cells: int
+) -> np.ndarray:
+    # The sorted cells with touched[keep] added and touched[~keep] removed.
+    if (len(cells) + len(touched)) * DENSE_RATIO < n_cells:
+        return merge_cells(
+            np.concatenate(
+                [cells[~np.isin(cells, touched, kind="sort")], touched[keep]]
+            ),
+            n_cells,
+        )
+
+    mask = np.zeros(n_cells, dtype=bool)
+    mask[cells] = True
+    mask[touched] = keep
+    return np.flatnonzero(mask)
+
+
+def may_change(table: np.ndarray) -> np.ndarray:
+    # Codes of the cells a (..., N_CODES) table may flip, the other cells
+    # keep their state whatever they draw.
+    alive = np.arange(N_CODES) >= N_CODES // 2
+    return np.where(alive, table < 1, table > 0)
+
+
+class FrontierState:
+    def __init__(
+        self, alive: np.ndarray, update_rates: np.ndarray, rng: PrismRNG
+    ):
+        self.size = alive.shape[-1]
+        self.update_rates = update_rates
+        self.rng = rng
+        self.topology = get_topology(self.size)
+        self.alive = alive
+        self.stimulated = np.zeros_like(alive)
+        self.alive_neighbors = (
+            count_alive_neighbors(self.topology.pad(alive))
+            .ravel()
+            .astype(np.int16)
+        )
+        self.alive_counts = np.count_nonzero(alive, axis=(1, 2))
+        self.unstable = np.empty(0, dtype=np.int64)
+        self.stimulated_cells = np.empty(0, dtype=np.int64)
+        # Sorted flat indices of the cells the last step flipped.
+        self.births = np.empty(0, dtype=np.int64)
+        self.dies = np.empty(0, dtype=np.int64)
+        self.rule_table = None
+        self.frontmost = None
+
+    def codes(self, cells: np.ndarray) -> np.ndarray:
+        flat_alive = self.alive.reshape(-1)
+        return rule_codes(
+            flat_alive[cells],
+            self.alive_neighbors[cells],
+            flat_alive[self.topology.below_of(cells)],
+        )
+
+    def is_unstable(self, cells: np.ndarray) -> np.ndarray:
+        return self.may_change[cells // self.size**2, self.codes(cells)]
+
+    def face_cells(self, face_index: int) -> np.ndarray:
+        return np.arange(self.size**2) + face_index * self.size**2
+
+    def set_rules(self, rule_table: np.ndarray, frontmost: int) -> None:
+        # Keeps the cells that may change on their next update, under the
+        # stochastic or the conventional rule, or the stimulus rule on the
+        # frontmost face.
+        primary, conventional = regime_tables(rule_table, frontmost)
+        self.may_change = may_change(primary) | may_change(conventional)
+        if rule_table is not self.rule_table:
+            cells = np.arange(self.topology.n_cells)
+            self.unstable = cells[self.is_unstable(cells)]
+        else:
+            faces = self.unstable // self.size**2
+            self.unstable = self.unstable[
+                (faces != frontmost) & (faces != self.frontmost)
+            ]
+            for face_index in (frontmost, self.frontmost):
+                cells = self.face_cells(face_index)
+                self.unstable = merge_cells(
+                    np.concatenate(
+                        [self.unstable, cells[self.is_unstable(cells)]]
+                    ),
+                    self.topology.n_cells,
+                )
+        self.rule_table = rule_table
+        self.frontmost = frontmost
+
+    def draw(self, due: np.ndarray, cells: np.ndarray) -> np.ndarray:
+        # Uniforms for the sorted cells, each due face still consumes a full
+        # batch of its stream so the draws match the other engines.
+        uniforms = np.ones(len(cells))
+        face_indices = cells // self.size**2
+        for face_index in np.flatnonzero(due):
+            on_face = face_indices == face_index
+            uniforms[on_face] = self.rng.sparse_uniforms(
+                face_index,
+                cells[on_face] - face_index * self.size**2,
+                self.size**2,
+            )
+        return uniforms
+
+    def evolve(
+        self,
+        due: np.ndarray,
+        frontmost: int,
+        threshold: int,
+        rule_table: np.ndarray = LEGACY_TABLE,
+    ) -> int:
+        size = self.size
+        flat_alive = self.alive.reshape(-1)
+        if rule_table is not self.rule_table or frontmost != self.frontmost:
+            self.set_rules(rule_table, frontmost)
+        candidates = self.unstable[due[self.unstable // size**2]]
+        alive = flat_alive[candidates]
+        faces = candidates // size**2
+        codes = self.codes(candidates)
+        primary, conventional = regime_tables(rule_table, frontmost)
+        primary, conventional = (
+            primary[faces, codes],
+            conventional[faces, codes],
+        )
+
+        # Only cells with an uncertain outcome draw, the others compare 0.5
+        # against a probability of 0 or 1.
+        uniforms = np.full(len(candidates), 0.5)
+        uncertain = ((0 < primary) & (primary < 1)) | (
+            (0 < conventional) & (conventional < 1)
+        )
+        uniforms[uncertain] = self.draw(due, candidates[uncertain])
+        primary_alive = uniforms < primary
+
+        # The threshold-th stimulated cell in visiting order is the last
+        # cell that follows the primary rule, as in evolve().
+        stochastic_births = candidates[primary_alive & ~alive]
+        if threshold <= 0:
+            boundary = -1
+        elif len(stochastic_births) >= threshold:
+            boundary = stochastic_births[threshold - 1]
+        else:
+            boundary = self.topology.n_cells
+        will_be_alive = np.where(
+            candidates <= boundary, primary_alive, uniforms < conventional
+        )
+        births = candidates[will_be_alive & ~alive]
+        dies = candidates[~will_be_alive & alive]
+
+        stimulated = self.stimulated.reshape(-1)
+        previous = self.stimulated_cells
+        previous_due = due[previous // size**2]
+        stimulated[previous[previous_due]] = False
+        stimulated[births] = True
+        self.stimulated_cells = merge_cells(
+            np.concatenate([previous[~previous_due], births]),
+            self.topology.n_cells,
+        )
+
+        self.flip(births, dies)
+        self.births, self.dies = births, dies
+        return len(births)
+
+    def flip(self, births: np.ndarray, dies: np.ndarray) -> None:
+        # Flips dead births and alive dies, keeping the neighbor counts and
+        # the unstable cells in sync.
+        flipped = np.concatenate([births, dies])
+        flat_alive = self.alive.reshape(-1)
+        flat_alive[flipped] = ~flat_alive[flipped]
+        n_faces = len(self.alive_counts)
+        self.alive_counts += np.bincount(
+            births // self.size**2, minlength=n_faces
+        ) - np.bincount(dies // self.size**2, minlength=n_faces)
+        sources, which = self.topology.neighbored_by(flipped)
+        np.add.at(
+            self.alive_neighbors,
+            sources,
+            np.where(which < len(births), 1, -1).astype(np.int16),
+        )
+        if self.rule_table is None:
+            return
+
+        # Only the flipped cells, the cells that count them as a neighbor
+        # and the cells above them can have become stable or unstable.
+        touched = merge_cells(
+            np.concatenate(
+                [flipped, sources, self.topology.above_of(flipped)[0]]
+            ),
+            self.topology.n_cells,
+        )
+        self.unstable = update_cells(
+            self.unstable,
+            touched,
+            self.is_unstable(touched),
+            self.topology.n_cells,
+        )
+
+    def set_alive(self, index: tuple[int], value: bool) -> None:
+        # Writes from the faces' cell views.
+        cell = np.array([np.ravel_multi_index(index, self.alive.shape)])
+        if self.alive.reshape(-1)[cell[0]] == value:
+            return
+
+        empty = np.empty(0, dtype=np.int64)
+        self.flip(*((cell, empty) if value else (empty, cell)))
+
+    def set_stimulated(self, index: tuple[int], value: bool) -> None:
+        self.stimulated[index] = value
+        cell = np.array([np.ravel_multi_index(index, self.alive.shape)])
+        self.stimulated_cells = update_cells(
+            self.stimulated_cells,
+            cell,
+            np.array([bool(value)]),
+            self.topology.n_cells,
+        )
@@ -1,7 +1,29 @@
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
 from enum import Enum
+from functools import cached_property, lru_cache
 
 import numpy as np
 
+from rng import PrismRNG
+from rules import (
+    CONVENTIONAL,
+    LEGACY_TABLE,
+    MAX_NEIGHBORS,
+    N_CODES,
+    STIMULUS,
+    STOCHASTIC,
+    FaceRules,
+    compile_rules,
+    count_runs,
+    regime_tables,
+    row_runs,
+    rule_code,
+    rule_codes,
+    rule_terms,
+)
+
 
 class RelativeFacePosition(Enum):
     TOP = 0
@@ -19,6 +41,46 @@ class FacePosition(Enum):
     BOTTOM = 5
 
 
+FACE_MAP: dict[FacePosition, dict[RelativeFacePosition, FacePosition]] = {
+    FacePosition.FRONT: {
+        RelativeFacePosition.TOP: FacePosition.TOP,
+        RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
+        RelativeFacePosition.LEFT: FacePosition.LEFT,
+        RelativeFacePosition.RIGHT: FacePosition.RIGHT,
+    },
+    FacePosition.BACK: {
+        RelativeFacePosition.TOP: FacePosition.TOP,
+        RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
+        RelativeFacePosition.LEFT: FacePosition.RIGHT,
+        RelativeFacePosition.RIGHT: FacePosition.LEFT,
+    },
+    FacePosition.LEFT: {
+        RelativeFacePosition.TOP: FacePosition.TOP,
+        RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
+        RelativeFacePosition.LEFT: FacePosition.BACK,
+        RelativeFacePosition.RIGHT: FacePosition.FRONT,
+    },
+    FacePosition.RIGHT: {
+        RelativeFacePosition.TOP: FacePosition.TOP,
+        RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
+        RelativeFacePosition.LEFT: FacePosition.FRONT,
+        RelativeFacePosition.RIGHT: FacePosition.BACK,
+    },
+    FacePosition.TOP: {
+        RelativeFacePosition.TOP: FacePosition.BACK,
+        RelativeFacePosition.BOTTOM: FacePosition.FRONT,
+        RelativeFacePosition.LEFT: FacePosition.LEFT,
+        RelativeFacePosition.RIGHT: FacePosition.RIGHT,
+    },
+    FacePosition.BOTTOM: {
+        RelativeFacePosition.TOP: FacePosition.FRONT,
+        RelativeFacePosition.BOTTOM: FacePosition.BACK,
+        RelativeFacePosition.LEFT: FacePosition.LEFT,
+        RelativeFacePosition.RIGHT: FacePosition.RIGHT,
+    },
+}
+
+
 class Cell:
     def __init__(self, face: "Face", position: tuple[int], is_alive: bool):
         self.face = face
@@ -42,23 +104,32 @@ class Cell:
 
 class Face:
     def __init__(
-        self, position: FacePosition, size: int, update_rate: int = 1
+        self,
+        position: FacePosition,
+        size: int,
+        update_rate: int = 1,
+        rng: np.random.Generator | None = None,
+        alive: np.ndarray | None = None,
     ):
         self.position = position
         self.size = size
-        self.cells = self._initialize_cells()
+        self.cells = self._initialize_cells(
+            rng or np.random.default_rng(), alive
+        )
         self.update_rate = update_rate
 
     def __repr__(self):
         return f"Face(position={self.position})"
 
-    def _initialize_cells(self) -> list[Cell]:
+    def _initialize_cells(
+        self, rng: np.random.Generator, alive: np.ndarray | None = None
+    ) -> list[Cell]:
+        # Random cells unless alive is given.
+        if alive is None:
+            alive = rng.random((self.size, self.size)) < 0.5
+        is_alive = np.asarray(alive, dtype=bool).tolist()
         return [
-            Cell(
-                face=self,
-                position=(i, j),
-                is_alive=np.random.choice([True, False], p=[0.5, 0.5]),
-            )
+            Cell(face=self, position=(i, j), is_alive=is_alive[i][j])
             for i in range(self.size)
             for j in range(self.size)
         ]
@@ -67,144 +138,928 @@ class Face:
         return self.cells[position[0] * self.size + position[1]]
 
 
-class Liquiprism:
-    def __init__(self, size: int, random_update_rate: bool = False):
+class CellView(Cell):
+    def __init__(self, face: "FaceView", position: tuple[int]):
+        self.face = face
+        self.position = position
+        self.will_be_alive = None
+
+    @property
+    def is_alive(self) -> bool:
+        return bool(self.face.state.alive[(self.face.index, *self.position)])
+
+    @is_alive.setter
+    def is_alive(self, value: bool) -> None:
+        state = self.face.state
+        if isinstance(state, ArrayState):
+            state.make_writeable()
+        elif hasattr(state, "set_alive"):
+            # The frontier engine keeps its neighbor counts in sync.
+            state.set_alive((self.face.index, *self.position), bool(value))
+            return
+        state.alive[(self.face.index, *self.position)] = value
+
+    @property
+    def stimulated(self) -> bool:
+        return bool(
+            self.face.state.stimulated[(self.face.index, *self.position)]
+        )
+
+    @stimulated.setter
+    def stimulated(self, value: bool) -> None:
+        state = self.face.state
+        if isinstance(state, ArrayState):
+            state.make_writeable()
+        elif hasattr(state, "set_stimulated"):
+            state.set_stimulated((self.face.index, *self.position), value)
+            return
+        state.stimulated[(self.face.index, *self.position)] = value
+
+
+class FaceView(Face):
+    def __init__(self, state: "ArrayState", position: FacePosition, size: int):
+        self.state = state
+        self.position = position
+        self.index = position.value
         self.size = size
-        self.faces = [
-            Face(
-                position=position,
-                size=size,
-                update_rate=(
-                    1 if not random_update_rate else np.random.randint(1, 4)
-                ),
+
+    @property
+    def update_rate(self) -> int:
+        return int(self.state.update_rates[self.index])
+
+    @update_rate.setter
+    def update_rate(self, value: int) -> None:
+        self.state.update_rates[self.index] = value
+
+    @property
+    def cells(self) -> list[CellView]:
+        return [
+            CellView(face=self, position=(i, j))
+            for i in range(self.size)
+            for j in range(self.size)
+        ]
+
+    def get_cell(self, position: tuple[int]) -> CellView:
+        return CellView(face=self, position=tuple(position))
+
+
+class ArrayState:
+    def __init__(
+        self,
+        alive: np.ndarray,
+        update_rates: np.ndarray,
+        stimulated: np.ndarray | None = None,
+    ):
+        self.alive = alive
+        self.stimulated = (
+            stimulated if stimulated is not None else np.zeros_like(alive)
+        )
+        self.update_rates = update_rates
+
+    def share(self) -> tuple[np.ndarray]:
+        # Hands out the cell arrays read-only instead of copying them, the
+        # next write to them copies them first.
+        self.alive.flags.writeable = False
+        self.stimulated.flags.writeable = False
+        return self.alive, self.stimulated
+
+    def make_writeable(self) -> None:
+        if not self.alive.flags.writeable:
+            self.alive = self.alive.copy()
+        if not self.stimulated.flags.writeable:
+            self.stimulated = self.stimulated.copy()
+
+
+NEIGHBOR_OFFSETS = [
+    (i_offset, j_offset)
+    for i_offset in [-1, 0, 1]
+    for j_offset in [-1, 0, 1]
+    if i_offset != 0 or j_offset != 0
+]
+
+
+class CubeTopology:
+    def __init__(self, size: int):
+        self.size = size
+        self.n_cells = len(FacePosition) * size**2
+
+        # Flat indices of the edge row/column each face sees across a seam.
+        edge = np.arange(size)
+        self.seams = {
+            relative_position: np.array(
+                [
+                    FACE_MAP[position][relative_position].value * size**2
+                    + edge_offsets
+                    for position in FacePosition
+                ]
             )
-            for position in list(FacePosition)
+            for relative_position, edge_offsets in [
+                (RelativeFacePosition.TOP, (size - 1) * size + edge),
+                (RelativeFacePosition.BOTTOM, edge),
+                (RelativeFacePosition.LEFT, edge * size + size - 1),
+                (RelativeFacePosition.RIGHT, edge * size),
+            ]
+        }
+        for seam in self.seams.values():
+            seam.flags.writeable = False
+
+    @cached_property
+    def padded_index(self) -> np.ndarray:
+        # Out-of-face corners (n_neighbor_faces == 2) point at n_cells, one
+        # past the last cell, so gathers can append a dead sentinel cell.
+        index = np.arange(self.n_cells).reshape(
+            len(FacePosition), self.size, self.size
+        )
+        padded_index = self.pad(index, fill=self.n_cells)
+        padded_index.flags.writeable = False
+        return padded_index
+
+    @cached_property
+    def neighbors(self) -> np.ndarray:
+        neighbors = np.stack(
+            [
+                self.padded_index[
+                    :,
+                    1 + i_offset : 1 + i_offset + self.size,
+                    1 + j_offset : 1 + j_offset + self.size,
+                ].ravel()
+                for i_offset, j_offset in NEIGHBOR_OFFSETS
+            ],
+            axis=-1,
+        )
+        neighbors.flags.writeable = False
+        return neighbors
+
+    @cached_property
+    def below(self) -> np.ndarray:
+        below = self.padded_index[:, 2:, 1:-1].ravel()
+        below.flags.writeable = False
+        return below
+
+    @cached_property
+    def neighbor_lists(self) -> list[list[int]]:
+        return [
+            [neighbor for neighbor in row if neighbor != self.n_cells]
+            for row in self.neighbors.tolist()
         ]
+
+    @cached_property
+    def below_list(self) -> list[int]:
+        return self.below.tolist()
+
+    def cell_index(self, face_position: FacePosition, position: tuple[int]):
+        i, j = position
+        return (face_position.value * self.size + i) * self.size + j
+
+    def offset_of(self, index: np.ndarray, i_offset: int, j_offset: int):
+        # Same lookup as padded_index for a few flat indices, without
+        # building the whole table.
+        size = self.size
+        face_index, position = np.divmod(index, size**2)
+        i, j = np.divmod(position, size)
+        i, j = i + i_offset, j + j_offset
+        i_inside = (i >= 0) & (i < size)
+        j_inside = (j >= 0) & (j < size)
+        i_clipped = np.clip(i, 0, size - 1)
+        j_clipped = np.clip(j, 0, size - 1)
+
+        offset = np.full(np.shape(index), self.n_cells)
+        for inside, seam_index in [
+            (i_inside & j_inside, face_index * size**2 + i * size + j),
+            (
+                (i < 0) & j_inside,
+                self.seams[RelativeFacePosition.TOP][face_index, j_clipped],
+            ),
+            (
+                (i >= size) & j_inside,
+                self.seams[RelativeFacePosition.BOTTOM][face_index, j_clipped],
+            ),
+            (
+                i_inside & (j < 0),
+                self.seams[RelativeFacePosition.LEFT][face_index, i_clipped],
+            ),
+            (
+                i_inside & (j >= size),
+                self.seams[RelativeFacePosition.RIGHT][face_index, i_clipped],
+            ),
+        ]:
+            offset = np.where(inside, seam_index, offset)
+        return offset
+
+    def neighbors_of(self, index: np.ndarray) -> np.ndarray:
+        return np.stack(
+            [
+                self.offset_of(index, i_offset, j_offset)
+                for i_offset, j_offset in NEIGHBOR_OFFSETS
+            ],
+            axis=-1,
+        )
+
+    def below_of(self, index: np.ndarray) -> np.ndarray:
+        # offset_of(index, 1, 0), only the last rows cross a seam.
+        size = self.size
+        index = np.asarray(index)
+        below = index + size
+        face_index, position = np.divmod(index, size**2)
+        last_row = position >= size * (size - 1)
+        below[last_row] = self.seams[RelativeFacePosition.BOTTOM][
+            face_index[last_row], position[last_row] - size * (size - 1)
+        ]
+        return below
+
+    def _seam_edges(self, offsets: list[tuple[int]]) -> tuple[np.ndarray]:
+        # (targets, sources) of every offset that crosses a seam, sorted by
+        # target. Seams are not symmetric, a cell may be seen from a face it
+        # does not see itself, so these cannot be derived from offset_of.
+        size = self.size
+        edge = np.arange(size)
+        border = np.unique(
+            np.concatenate(
+                [
+                    edge,
+                    (size - 1) * size + edge,
+                    edge * size,
+                    edge * size + size - 1,
+                ]
+            )
+        )
+        border = (
+            np.arange(len(FacePosition))[:, None] * size**2 + border
+        ).ravel()
+
+        targets, sources = [], []
+        for i_offset, j_offset in offsets:
+            target = self.offset_of(border, i_offset, j_offset)
+            crosses = (target != self.n_cells) & (
+                target // size**2 != border // size**2
+            )
+            targets.append(target[crosses])
+            sources.append(border[crosses])
+        targets = np.concatenate(targets)
+        sources = np.concatenate(sources)
+        order = np.argsort(targets, kind="stable")
+        return targets[order], sources[order]
+
+    @cached_property
+    def seam_neighbor_edges(self) -> tuple[np.ndarray]:
+        return self._seam_edges(NEIGHBOR_OFFSETS)
+
+    @cached_property
+    def seam_below_edges(self) -> tuple[np.ndarray]:
+        return self._seam_edges([(1, 0)])
+
+    def _sources_of(
+        self, index: np.ndarray, offsets: list[tuple[int]], seam_edges
+    ) -> tuple[np.ndarray]:
+        # Every cell that reaches one of index through one of offsets, once
+        # per way it does, with the position in index it reaches.
+        size = self.size
+        face_index, position = np.divmod(index, size**2)
+        i, j = np.divmod(position, size)
+        sources, which = [], []
+        for i_offset, j_offset in offsets:
+            source_i, source_j = i - i_offset, j - j_offset
+            inside = (
+                (source_i >= 0)
+                & (source_i < size)
+                & (source_j >= 0)
+                & (source_j < size)
+            )
+            sources.append(
+                (face_index * size**2 + source_i * size + source_j)[inside]
+            )
+            which.append(np.flatnonzero(inside))
+
+        targets, seam_sources = seam_edges
+        start = np.searchsorted(targets, index, side="left")
+        counts = np.searchsorted(targets, index, side="right") - start
+        seam_which = np.repeat(np.arange(len(index)), counts)
+        seam_position = (
+            np.arange(counts.sum())
+            - np.repeat(np.cumsum(counts) - counts, counts)
+            + np.repeat(start, counts)
+        )
+        sources.append(seam_sources[seam_position])
+        which.append(seam_which)
+        return np.concatenate(sources), np.concatenate(which)
+
+    def neighbored_by(self, index: np.ndarray) -> tuple[np.ndarray]:
+        return self._sources_of(
+            index, NEIGHBOR_OFFSETS, self.seam_neighbor_edges
+        )
+
+    def above_of(self, index: np.ndarray) -> tuple[np.ndarray]:
+        return self._sources_of(index, [(1, 0)], self.seam_below_edges)
+
+    def pad(self, values: np.ndarray, fill=0) -> np.ndarray:
+        # (..., 6, size, size) -> (..., 6, size + 2, size + 2) where the border
+        # holds the seam rows and columns of the adjacent faces.
+        flat = values.reshape(values.shape[:-3] + (-1,))
+        padded = np.full(
+            values.shape[:-2] + (self.size + 2, self.size + 2),
+            fill,
+            dtype=values.dtype,
+        )
+        padded[..., 1:-1, 1:-1] = values
+        padded[..., 0, 1:-1] = flat[..., self.seams[RelativeFacePosition.TOP]]
+        padded[..., -1, 1:-1] = flat[
+            ..., self.seams[RelativeFacePosition.BOTTOM]
+        ]
+        padded[..., 1:-1, 0] = flat[..., self.seams[RelativeFacePosition.LEFT]]
+        padded[..., 1:-1, -1] = flat[
+            ..., self.seams[RelativeFacePosition.RIGHT]
+        ]
+        return padded
+
+
+@lru_cache(maxsize=16)
+def get_topology(size: int) -> CubeTopology:
+    return CubeTopology(size)
+
+
+def count_alive_neighbors(padded: np.ndarray) -> np.ndarray:
+    rows, columns = padded.shape[-2] - 2, padded.shape[-1] - 2
+    counts = np.zeros(padded.shape[:-2] + (rows, columns), dtype=np.uint8)
+    for i_offset, j_offset in NEIGHBOR_OFFSETS:
+        counts += padded[
+            ...,
+            1 + i_offset : 1 + i_offset + rows,
+            1 + j_offset : 1 + j_offset + columns,
+        ]
+    return counts
+
+
+# Below this many cells, looking up each cell's probability is faster than
+# evaluating a rule table with array comparisons.
+LOOKUP_CELLS = 10_000
+
+
+def count_in(alive_neighbors: np.ndarray, count_set: frozenset[int]):
+    if len(count_set) == MAX_NEIGHBORS + 1:
+        return True
+
+    mask = None
+    for first, last in count_runs(count_set):
+        # Counts below first wrap around, so one comparison covers the run.
+        run = (
+            np.subtract(alive_neighbors, first, dtype=np.uint8) <= last - first
+        )
+        mask = run if mask is None else mask | run
+    return mask
+
+
+def apply_rule_table(
+    table: np.ndarray,
+    alive: np.ndarray,
+    alive_neighbors: np.ndarray,
+    bellow_alive: np.ndarray,
+    uniforms: np.ndarray,
+) -> np.ndarray:
+    # Draws the next state of (..., size, size) cells from the (..., N_CODES)
+    # table of their probability of being alive. Small grids look every
+    # cell up, larger ones evaluate the faces sharing a row together with
+    # the comparisons of rule_terms.
+    shape = alive.shape
+    if alive.size < LOOKUP_CELLS:
+        table = table.reshape(-1, N_CODES)
+        codes = rule_codes(alive, alive_neighbors, bellow_alive)
+        faces = np.arange(len(table))[:, None]
+        return uniforms < table[faces, codes.reshape(len(table), -1)].reshape(
+            shape
+        )
+
+    arrays = [
+        array.reshape((-1,) + shape[-2:])
+        for array in (alive, alive_neighbors, bellow_alive, uniforms)
+    ]
+    will_be_alive = np.zeros(arrays[0].shape, dtype=bool)
+    for row, faces in row_runs(table.reshape(-1, N_CODES)):
+        alive, alive_neighbors, bellow_alive, uniforms = (
+            array[faces] for array in arrays
+        )
+        belows = {None: True, True: bellow_alive, False: ~bellow_alive}
+        counts_in = {}
+        for probability, terms in rule_terms(row):
+            drawn = uniforms < probability if probability < 1 else True
+            for cell_alive, below, count_set in terms:
+                if count_set not in counts_in:
+                    counts_in[count_set] = count_in(alive_neighbors, count_set)
+                # True stands for every cell, and is skipped since and-ing
+                # an array with a Python bool is much slower.
+                term = alive.copy() if cell_alive else ~alive
+                for condition in (
+                    belows[below],
+                    counts_in[count_set],
+                    drawn,
+                ):
+                    if condition is not True:
+                        term &= condition
+                will_be_alive[faces] |= term
+    return will_be_alive.reshape(shape)
+
+
+def evolve(
+    alive: np.ndarray,
+    stimulated: np.ndarray,
+    topology: CubeTopology,
+    due: np.ndarray,
+    frontmost: np.ndarray,
+    threshold: int,
+    uniforms: np.ndarray,
+    rule_table: np.ndarray = LEGACY_TABLE,
+) -> np.ndarray:
+    # alive/stimulated/uniforms are (..., 6, size, size), due is (..., 6) and
+    # frontmost holds the frontmost face index per leading index. Updates the
+    # due faces in place and returns the activity per leading index.
+    padded = topology.pad(alive)
+    cells = (alive, count_alive_neighbors(padded), padded[..., 2:, 1:-1])
+    primary, conventional = regime_tables(rule_table, frontmost)
+
+    due = due[..., None, None]
+    will_be_alive = apply_rule_table(
+        primary if threshold > 0 else conventional, *cells, uniforms
+    )
+    will_stimulate = will_be_alive & ~alive & due
+
+    # Cells are visited face by face in row-major order, and every cell after
+    # the activity counter reaches the threshold follows the conventional rule.
+    if (
+        threshold > 0
+        and (will_stimulate.sum(axis=(-3, -2, -1)) >= threshold).any()
+    ):
+        flat_stimulate = will_stimulate.reshape(alive.shape[:-3] + (-1,))
+        stimulated_before = np.cumsum(flat_stimulate, axis=-1) - flat_stimulate
+        is_conventional = (stimulated_before >= threshold).reshape(alive.shape)
+        will_be_alive = np.where(
+            is_conventional,
+            apply_rule_table(conventional, *cells, uniforms),
+            will_be_alive,
+        )
+        will_stimulate = will_be_alive & ~alive & due
+
+    np.copyto(stimulated, will_stimulate, where=due)
+    np.copyto(alive, will_be_alive, where=due)
+    return will_stimulate.sum(axis=(-3, -2, -1))
+
+
+def own_cells(cells: np.ndarray) -> np.ndarray:
+    # Read-only arrays, such as a snapshot's, are shared and copied on the
+    # first write. Writable ones may still be changed by the caller.
+    return cells if not cells.flags.writeable else cells.copy()
+
+
+@dataclass(frozen=True)
+class PrismSnapshot:
+    size: int
+    engine: str
+    alive: np.ndarray  # read-only, may be shared with the prism
+    stimulated: np.ndarray
+    update_rates: tuple[int]
+    step_counter: int
+    activity: int
+    frontmost: int
+    threshold: int
+    activity_mode: str
+    rules: dict[FacePosition, FaceRules] | FaceRules | None
+    rule_table: np.ndarray
+    rng_state: dict
+
+
+@dataclass(frozen=True)
+class StepRecord:
+    step_counter: int  # of the step that was computed
+    wall_time: float  # seconds the step took
+    activity: int
+    updated: np.ndarray  # (6,) whether each face was due
+    alive_counts: np.ndarray  # (6,) alive cells per face after the step
+    stimulated: np.ndarray  # flat indices of the cells born in the step
+    died: np.ndarray  # flat indices of the cells that died in the step
+
+
+class Liquiprism:
+    ENGINES = ("cells", "numpy", "bitpacked", "sharded", "frontier")
+    # How a step decides between the stochastic and the conventional rule:
+    # "sequential" switches after the threshold-th stimulated cell of the
+    # step in visiting order, "previous" uses one rule for the whole step,
+    # the conventional one if the previous step's activity reached the
+    # threshold.
+    ACTIVITY_MODES = ("sequential", "previous")
+
+    def __init__(
+        self,
+        size: int,
+        random_update_rate: bool = False,
+        engine: str = "cells",
+        workers: int | None = None,
+        seed: int | np.random.SeedSequence | None = None,
+        activity_mode: str = "sequential",
+        alive: np.ndarray | None = None,
+        stimulated: np.ndarray | None = None,
+    ):
+        # alive and stimulated are (6, size, size) starting cells, random
+        # and none when not given. The faces' streams are only drawn from
+        # for random cells.
+        if engine not in self.ENGINES:
+            raise ValueError(
+                f"Unknown engine {engine!r}, expected one of {self.ENGINES}"
+            )
+        if activity_mode not in self.ACTIVITY_MODES:
+            raise ValueError(
+                f"Unknown activity mode {activity_mode!r}, expected one of "
+                f"{self.ACTIVITY_MODES}"
+            )
+
+        alive, stimulated = (
+            None if cells is None else np.asarray(cells)
+            for cells in (alive, stimulated)
+        )
+        for name, cells in (("alive", alive), ("stimulated", stimulated)):
+            if cells is not None and (
+                cells.shape != (len(FacePosition), size, size)
+                or cells.dtype != bool
+            ):
+                raise ValueError(
+                    f"{name} must be a bool array of shape "
+                    f"{(len(FacePosition), size, size)}"
+                )
+
+        self.size = size
+        self.engine = engine
+        self.activity_mode = activity_mode
+        self.rng = PrismRNG(seed)
+        update_rates = self.rng.update_rates(random_update_rate)
+        if engine == "cells":
+            self.faces = [
+                Face(
+                    position=position,
+                    size=size,
+                    update_rate=int(update_rates[position.value]),
+                    rng=self.rng.faces[position.value],
+                    alive=alive[position.value] if alive is not None else None,
+                )
+                for position in list(FacePosition)
+            ]
+            self._cells = [cell for face in self.faces for cell in face.cells]
+        else:
+            if alive is None and engine != "bitpacked":
+                alive = self.rng.initial_states(size)
+            if engine == "bitpacked":
+                from bitpacked import PackedGrid, PackedState
+
+                self.state = PackedState(
+                    (
+                        PackedGrid.random(size, self.rng)
+                        if alive is None
+                        else PackedGrid.from_array(alive)
+                    ),
+                    update_rates,
+                    self.rng,
+                )
+            elif engine == "numpy":
+                self.state = ArrayState(own_cells(alive), update_rates)
+            elif engine == "frontier":
+                from frontier import FrontierState
+
+                # The frontier engine flips its cells in place.
+                self.state = FrontierState(
+                    alive.copy(), update_rates, self.rng
+                )
+            else:
+                from parallel import ShardedState
+
+                self.state = ShardedState(
+                    alive,
+                    update_rates,
+                    self.rng,
+                    workers,
+                )
+            self.faces = [
+                FaceView(state=self.state, position=position, size=size)
+                for position in list(FacePosition)
+            ]
         self.face_map = self._initialize_face_map()
+        self.topology = get_topology(size)
         self.activity = 0  # counter for number of cells that were stimulated in the last step
         self.CELL_STATE_CHANGE_THRESHOLD = self.size**2
         self.step_counter = 0
         self.frontmost_face = self.faces[0]
+        self.set_rules(None)
+        self.observers = []
+        if stimulated is not None:
+            self._set_stimulated(stimulated)
 
-    def _initialize_face_map(self) -> dict[FacePosition, dict[str, Face]]:
-        return {
-            FacePosition.FRONT: {
-                RelativeFacePosition.TOP: FacePosition.TOP,
-                RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
-                RelativeFacePosition.LEFT: FacePosition.LEFT,
-                RelativeFacePosition.RIGHT: FacePosition.RIGHT,
-            },
-            FacePosition.BACK: {
-                RelativeFacePosition.TOP: FacePosition.TOP,
-                RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
-                RelativeFacePosition.LEFT: FacePosition.RIGHT,
-                RelativeFacePosition.RIGHT: FacePosition.LEFT,
-            },
-            FacePosition.LEFT: {
-                RelativeFacePosition.TOP: FacePosition.TOP,
-                RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
-                RelativeFacePosition.LEFT: FacePosition.BACK,
-                RelativeFacePosition.RIGHT: FacePosition.FRONT,
-            },
-            FacePosition.RIGHT: {
-                RelativeFacePosition.TOP: FacePosition.TOP,
-                RelativeFacePosition.BOTTOM: FacePosition.BOTTOM,
-                RelativeFacePosition.LEFT: FacePosition.FRONT,
-                RelativeFacePosition.RIGHT: FacePosition.BACK,
-            },
-            FacePosition.TOP: {
-                RelativeFacePosition.TOP: FacePosition.BACK,
-                RelativeFacePosition.BOTTOM: FacePosition.FRONT,
-                RelativeFacePosition.LEFT: FacePosition.LEFT,
-                RelativeFacePosition.RIGHT: FacePosition.RIGHT,
-            },
-            FacePosition.BOTTOM: {
-                RelativeFacePosition.TOP: FacePosition.FRONT,
-                RelativeFacePosition.BOTTOM: FacePosition.BACK,
-                RelativeFacePosition.LEFT: FacePosition.LEFT,
-                RelativeFacePosition.RIGHT: FacePosition.RIGHT,
-            },
-        }
+    def _initialize_face_map(
+        self,
+    ) -> dict[FacePosition, dict[RelativeFacePosition, FacePosition]]:
+        return FACE_MAP
+
+    def _collect_cells(self, attribute: str) -> np.ndarray:
+        return np.array(
+            [
+                [bool(getattr(cell, attribute)) for cell in face.cells]
+                for face in self.faces
+            ]
+        ).reshape(len(FacePosition), self.size, self.size)
+
+    def get_alive_array(self) -> np.ndarray:
+        if self.engine == "cells":
+            return self._collect_cells("is_alive")
+        if self.engine == "bitpacked":
+            return self.state.alive.to_array()
+
+        return self.state.alive.copy()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        if self.engine == "cells":
+            return self._collect_cells("stimulated")
+        if self.engine == "bitpacked":
+            return self.state.stimulated.to_array()
+
+        return self.state.stimulated.copy()
 
     def get_face(self, face_position: FacePosition) -> Face:
-        return next(
-            face for face in self.faces if face.position == face_position
-        )
+        return self.faces[face_position.value]
+
+    def _get_cell_at(self, index: int) -> Cell:
+        if self.engine == "cells":
+            return self._cells[index]
+
+        face_index, position = divmod(index, self.size**2)
+        return self.faces[face_index].get_cell(divmod(position, self.size))
 
     def get_cell_neighbors(self, face: Face, cell: Cell) -> list[Cell]:
-        i, j = cell.position
-        neighbors = []
-
-        for i_offset in [-1, 0, 1]:
-            for j_offset in [-1, 0, 1]:
-                if i_offset == 0 and j_offset == 0:
-                    continue
-                ni, nj = i + i_offset, j + j_offset
-                if 0 <= ni < face.size and 0 <= nj < face.size:
-                    neighbors.append(face.get_cell((ni, nj)))
-                else:
-                    neighbors.extend(
-                        self.get_adjacent_face_cell_neighbors(
-                            face, cell, i_offset, j_offset
-                        )
-                    )
+        index = self.topology.cell_index(face.position, cell.position)
+        if self.engine == "cells":
+            return [
+                self._cells[neighbor]
+                for neighbor in self.topology.neighbor_lists[index]
+            ]
 
-        return neighbors
+        return [
+            self._get_cell_at(neighbor)
+            for neighbor in self.topology.neighbor_lists[index]
+        ]
 
     def get_bellow_cell_neighbor(self, face: Face, cell: Cell) -> Cell:
-        i, j = cell.position
-        if i == face.size - 1:
-            neighbor_face = self.get_face(
-                self.face_map[face.position][RelativeFacePosition.BOTTOM]
-            )
-            return neighbor_face.get_cell((0, j))
-
-        return face.get_cell((i + 1, j))
+        return self._get_cell_at(
+            self.topology.below_list[
+                self.topology.cell_index(face.position, cell.position)
+            ]
+        )
 
     def get_adjacent_face_cell_neighbors(
         self, face: Face, cell: Cell, i_offset: int, j_offset: int
     ) -> list[Cell]:
-        neighbors = []
+        neighbor = self.topology.neighbors[
+            self.topology.cell_index(face.position, cell.position),
+            NEIGHBOR_OFFSETS.index((i_offset, j_offset)),
+        ]
+        if neighbor == self.topology.n_cells:
+            return []
 
-        i, j = cell.position
-        ni, nj = i + i_offset, j + j_offset
+        return [self._get_cell_at(int(neighbor))]
 
-        neighbor_face = face
-        n_neighbor_faces = 0
+    def set_rules(
+        self, rules: dict[FacePosition, FaceRules] | FaceRules | None
+    ) -> None:
+        # Faces missing from rules follow the legacy rules.
+        self.rules = rules
+        self.rule_table = (
+            compile_rules(rules) if rules is not None else LEGACY_TABLE
+        )
+        self._rule_lists = self.rule_table.tolist()
+
+    def snapshot(self) -> PrismSnapshot:
+        # The numpy engine shares its cell arrays with the snapshot until
+        # either side writes to them, the other engines copy them.
+        if self.engine == "numpy":
+            alive, stimulated = self.state.share()
+        else:
+            alive = self.get_alive_array()
+            stimulated = self.get_stimulated_array()
+            alive.flags.writeable = False
+            stimulated.flags.writeable = False
+        return PrismSnapshot(
+            size=self.size,
+            engine=self.engine,
+            alive=alive,
+            stimulated=stimulated,
+            update_rates=tuple(face.update_rate for face in self.faces),
+            step_counter=self.step_counter,
+            activity=self.activity,
+            frontmost=self.frontmost_face.position.value,
+            threshold=self.CELL_STATE_CHANGE_THRESHOLD,
+            activity_mode=self.activity_mode,
+            rules=self.rules,
+            rule_table=self.rule_table,
+            rng_state=self.rng.get_state(),
+        )
 
-        if ni < 0:
-            neighbor_face = self.get_face(
-                self.face_map[face.position][RelativeFacePosition.TOP]
+    def restore(self, snapshot: PrismSnapshot) -> None:
+        # Puts the prism back in the snapshot's state, the following steps
+        # are the ones the snapshotted prism would have computed.
+        if snapshot.size != self.size:
+            raise ValueError(
+                f"Cannot restore a size {snapshot.size} snapshot into a "
+                f"size {self.size} prism"
             )
-            ni = face.size - 1
-            n_neighbor_faces += 1
-        elif ni >= face.size:
-            neighbor_face = self.get_face(
-                self.face_map[face.position][RelativeFacePosition.BOTTOM]
+
+        if self.engine == "cells":
+            for face, alive in zip(self.faces, snapshot.alive):
+                for cell in face.cells:
+                    cell.is_alive = bool(alive[cell.position])
+                    cell.will_be_alive = None
+        elif self.engine == "numpy":
+            self.state.alive = snapshot.alive
+        elif self.engine == "bitpacked":
+            from bitpacked import PackedGrid
+
+            self.state.alive = PackedGrid.from_array(snapshot.alive)
+        elif self.engine == "frontier":
+            from frontier import FrontierState
+
+            # Neighbor counts and unstable cells are rebuilt from the cells.
+            self.state = FrontierState(
+                snapshot.alive.copy(), self.state.update_rates, self.rng
             )
-            ni = 0
-            n_neighbor_faces += 1
+            self.faces = [
+                FaceView(state=self.state, position=position, size=self.size)
+                for position in list(FacePosition)
+            ]
+        else:
+            self.state.alive[:] = snapshot.alive
+        self._set_stimulated(snapshot.stimulated)
+        self._restore_settings(snapshot)
 
-        if nj < 0:
-            neighbor_face = self.get_face(
-                self.face_map[face.position][RelativeFacePosition.LEFT]
+    def _set_stimulated(self, stimulated: np.ndarray) -> None:
+        if self.engine == "cells":
+            for face, face_stimulated in zip(self.faces, stimulated):
+                for cell in face.cells:
+                    cell.stimulated = bool(face_stimulated[cell.position])
+        elif self.engine == "numpy":
+            self.state.stimulated = own_cells(stimulated)
+        elif self.engine == "bitpacked":
+            from bitpacked import PackedGrid
+
+            self.state.stimulated = PackedGrid.from_array(stimulated)
+        elif self.engine == "frontier":
+            self.state.stimulated[:] = stimulated
+            self.state.stimulated_cells = np.flatnonzero(stimulated)
+        else:
+            self.state.stimulated[:] = stimulated
+
+    def _restore_settings(self, snapshot: PrismSnapshot) -> None:
+        for face, update_rate in zip(self.faces, snapshot.update_rates):
+            face.update_rate = update_rate
+
+        self.step_counter = snapshot.step_counter
+        self.activity = snapshot.activity
+        self.frontmost_face = self.faces[snapshot.frontmost]
+        self.CELL_STATE_CHANGE_THRESHOLD = snapshot.threshold
+        self.activity_mode = snapshot.activity_mode
+        # The compiled rules are shared rather than compiled again.
+        self.rules = snapshot.rules
+        self.rule_table = snapshot.rule_table
+        self._rule_lists = self.rule_table.tolist()
+        self.rng.set_state(snapshot.rng_state)
+
+    @classmethod
+    def from_snapshot(
+        cls,
+        snapshot: PrismSnapshot,
+        engine: str | None = None,
+        workers: int | None = None,
+    ) -> "Liquiprism":
+        # The engine is built from the snapshot's cells, no random cells are
+        # drawn only to be replaced.
+        liquiprism = cls(
+            snapshot.size,
+            engine=engine or snapshot.engine,
+            workers=workers,
+            alive=snapshot.alive,
+            stimulated=snapshot.stimulated,
+        )
+        liquiprism._restore_settings(snapshot)
+        return liquiprism
+
+    def fork(self, engine: str | None = None) -> "Liquiprism":
+        # An independent prism continuing from the current state, it steps
+        # exactly like this prism would until either of them is changed.
+        return Liquiprism.from_snapshot(self.snapshot(), engine)
+
+    def close(self) -> None:
+        if self.engine == "sharded":
+            self.state.close()
+
+    def _due_faces(self) -> np.ndarray:
+        return np.array(
+            [self.step_counter % face.update_rate == 0 for face in self.faces]
+        )
+
+    def step_threshold(self) -> int:
+        # The threshold the next step applies in visiting order. In the
+        # "previous" mode it is 0 when every cell follows the conventional
+        # rule and out of reach when every cell follows the stochastic one,
+        # so every cell of the step can be evaluated independently.
+        if self.activity_mode == "sequential":
+            return self.CELL_STATE_CHANGE_THRESHOLD
+        if self.activity >= self.CELL_STATE_CHANGE_THRESHOLD:
+            return 0
+        return self.topology.n_cells + 1
+
+    def subscribe(self, observer: Callable[[StepRecord], None]) -> None:
+        # observer is called with a StepRecord after every step.
+        self.observers.append(observer)
+
+    def unsubscribe(self, observer: Callable[[StepRecord], None]) -> None:
+        self.observers.remove(observer)
+
+    def step(self) -> None:
+        # Without observers a step does no bookkeeping for them at all.
+        if not self.observers:
+            self._step()
+            return
+
+        due = self._due_faces()
+        alive_before = self._alive_before()
+        start = time.perf_counter()
+        self._step()
+        wall_time = time.perf_counter() - start
+
+        stimulated, died, alive_counts = self._step_changes(due, alive_before)
+        record = StepRecord(
+            step_counter=self.step_counter - 1,
+            wall_time=wall_time,
+            activity=self.activity,
+            updated=due,
+            alive_counts=alive_counts,
+            stimulated=stimulated,
+            died=died,
+        )
+        for observer in self.observers:
+            observer(record)
+
+    def _alive_before(self) -> np.ndarray | None:
+        # What _step_changes() needs of the cells before a step. The numpy
+        # engine shares its array read-only, its step copies it anyway, and
+        # the frontier engine keeps the cells it flips.
+        if self.engine == "numpy":
+            self.state.alive.flags.writeable = False
+            return self.state.alive
+        if self.engine == "bitpacked":
+            return self.state.alive.words.copy()
+        if self.engine == "frontier":
+            return None
+        return self.get_alive_array()
+
+    def _step_changes(
+        self, due: np.ndarray, alive_before: np.ndarray | None
+    ) -> tuple[np.ndarray]:
+        # Flat indices of the cells stimulated and died in the last step,
+        # and the alive cells per face, without copying the engine's cells.
+        if self.engine == "frontier":
+            return (
+                self.state.births,
+                self.state.dies,
+                self.state.alive_counts.copy(),
             )
-            nj = face.size - 1
-            n_neighbor_faces += 1
-        elif nj >= face.size:
-            neighbor_face = self.get_face(
-                self.face_map[face.position][RelativeFacePosition.RIGHT]
+        if self.engine == "bitpacked":
+            from bitpacked import set_cells
+
+            alive = self.state.alive.words
+            stimulated = self.state.stimulated.words
+            return (
+                set_cells(
+                    np.where(due[:, None, None], stimulated, 0), self.size
+                ),
+                set_cells(alive_before & ~alive, self.size),
+                np.bitwise_count(alive).sum(axis=(1, 2), dtype=np.int64),
             )
-            nj = 0
-            n_neighbor_faces += 1
 
-        if n_neighbor_faces == 1:
-            neighbors.append(neighbor_face.get_cell((ni, nj)))
+        if self.engine == "cells":
+            alive = self.get_alive_array()
+            stimulated = self.get_stimulated_array()
+        else:
+            alive, stimulated = self.state.alive, self.state.stimulated
+        return (
+            np.flatnonzero(stimulated & due[:, None, None]),
+            np.flatnonzero(alive_before & ~alive),
+            np.count_nonzero(alive, axis=(1, 2)),
+        )
 
-        return neighbors
+    def _step(self) -> None:
+        due = self._due_faces()
+        threshold = self.step_threshold()
+        if self.engine == "numpy":
+            self._step_numpy(due, threshold)
+            return
+        if self.engine in ("bitpacked", "sharded", "frontier"):
+            self._step_state(due, threshold)
+            return
 
-    def step(self) -> None:
         self.activity = 0
+        self._threshold = threshold
+        self._uniforms = self.rng.step_uniforms(due, self.size)
 
         for face in self.faces:
             if self.step_counter % face.update_rate == 0:
@@ -219,50 +1074,105 @@ class Liquiprism:
 
         self.step_counter += 1
 
+    def _step_numpy(self, due: np.ndarray, threshold: int) -> None:
+        self.state.make_writeable()
+        self.activity = int(
+            evolve(
+                self.state.alive,
+                self.state.stimulated,
+                self.topology,
+                due=due,
+                frontmost=self.frontmost_face.index,
+                threshold=threshold,
+                uniforms=self.rng.step_uniforms(due, self.size),
+                rule_table=self.rule_table,
+            )
+        )
+        self.step_counter += 1
+
+    def _step_state(self, due: np.ndarray, threshold: int) -> None:
+        self.activity = self.state.evolve(
+            due=due,
+            frontmost=self.frontmost_face.index,
+            threshold=threshold,
+            rule_table=self.rule_table,
+        )
+        self.step_counter += 1
+
     def _apply_rules(self, face: Face, cell: Cell) -> None:
         if self.frontmost_face == face:
-            cell.will_be_alive = self._apply_stimulus_rule(cell)
+            regime = STIMULUS
+        elif self.activity < self._threshold:
+            regime = STOCHASTIC
         else:
-            neighbors = self.get_cell_neighbors(face, cell)
-            alive_neighbors = sum(
-                1 for neighbor in neighbors if neighbor.is_alive
-            )
-
-            if self.activity < self.CELL_STATE_CHANGE_THRESHOLD:
-                cell.will_be_alive = self._apply_stochastic_rule(
-                    cell, alive_neighbors
-                )
-            else:
-                cell.will_be_alive = self._apply_conventional_rule(
-                    cell, alive_neighbors
-                )
+            regime = CONVENTIONAL
+        cell.will_be_alive = self._apply_rule(face, cell, regime)
 
         cell.stimulated = cell.will_be_alive and not cell.is_alive
         if cell.stimulated:
             self.activity += 1
 
-    def _apply_conventional_rule(
-        self, cell: Cell, alive_neighbors: int
-    ) -> bool:
-        if cell.is_alive:
-            return alive_neighbors in [2, 3]
+    def _apply_rule(self, face: Face, cell: Cell, regime: int) -> bool:
+        index = self.topology.cell_index(face.position, cell.position)
+        alive_neighbors = sum(
+            1
+            for neighbor in self.topology.neighbor_lists[index]
+            if self._cells[neighbor].is_alive
+        )
+        code = rule_code(
+            cell.is_alive,
+            alive_neighbors,
+            self._cells[self.topology.below_list[index]].is_alive,
+        )
+        probability = self._rule_lists[face.position.value][regime][code]
+        return bool(
+            self._uniforms[face.position.value][cell.position] < probability
+        )
+
 
-        return alive_neighbors >= 4
+class PrismFrame:
+    # The prism's cells at one step, drawn while the prism moves on. Setting
+    # its frontmost face changes the frame and, with set_frontmost, asks for
+    # it on the prism, which applies it between steps.
+    def __init__(
+        self,
+        liquiprism: Liquiprism,
+        set_frontmost: Callable[[FacePosition], None] | None = None,
+    ):
+        snapshot = liquiprism.snapshot()
+        self.set_frontmost = set_frontmost
+        self.size = snapshot.size
+        self.step_counter = snapshot.step_counter
+        self.activity = snapshot.activity
+        self.state = ArrayState(
+            alive=snapshot.alive,
+            update_rates=np.array(snapshot.update_rates),
+            stimulated=snapshot.stimulated,
+        )
+        self.faces = [
+            FaceView(state=self.state, position=position, size=self.size)
+            for position in list(FacePosition)
+        ]
+        self._frontmost_face = self.faces[snapshot.frontmost]
 
-    def _apply_stochastic_rule(self, cell: Cell, alive_neighbors: int) -> bool:
-        if cell.is_alive:
-            return alive_neighbors in [2, 3]
+    def __repr__(self):
+        return f"PrismFrame(step_counter={self.step_counter})"
 
-        bellow_neighbor = self.get_bellow_cell_neighbor(cell.face, cell)
+    @property
+    def frontmost_face(self) -> FaceView:
+        return self._frontmost_face
 
-        return bellow_neighbor.is_alive and np.random.choice(
-            [True, False], p=[1 / 3, 2 / 3]
-        )
+    @frontmost_face.setter
+    def frontmost_face(self, face: Face) -> None:
+        self._frontmost_face = self.faces[face.position.value]
+        if self.set_frontmost is not None:
+            self.set_frontmost(face.position)
 
-    def _apply_stimulus_rule(
-        self, cell: Cell, activation_probability: int = 0.2
-    ) -> bool:
-        return cell.is_alive or np.random.choice(
-            [True, False],
-            p=[activation_probability, 1 - activation_probability],
-        )
+    def get_face(self, face_position: FacePosition) -> FaceView:
+        return self.faces[face_position.value]
+
+    def get_alive_array(self) -> np.ndarray:
+        return self.state.alive.copy()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        return self.state.stimulated.copy()
@@ -1,36 +1,88 @@
 import pygame
 
+from events import EventBus, MidiFileSink, PortSink, UDPSink
 from liquiprism import Liquiprism
-from sonifier import Sonifier
+from profiler import FrameProfiler
+from scheduler import StepScheduler
+from sonifier import MIDI_PORT, Sonifier
+from telemetry import TelemetryBuffer
+from trajectory import TrajectoryRecorder, TrajectoryReplay
 from visualizer import Visualizer
 
 SIZE = 7
 RANDOM_UPDATE_RATE = True
 STEP_TIME = 1000
+ENGINE = "numpy"
+SEED = None
+ACTIVITY_MODE = "sequential"  # or "previous", see Liquiprism.ACTIVITY_MODES
+RULES = None  # e.g. {FacePosition.TOP: FaceRules(birth=frozenset({3, 6}))}
+PROFILE_CSV = None  # e.g. "profile.csv" to keep the phase timings on exit
+RECORD_PATH = None  # e.g. "performance.lqt" to record every step
+REPLAY_PATH = None  # play a recorded trajectory instead of a new prism
+MIDI_FILE_PATH = None  # e.g. "performance.mid" to also write the notes
+UDP_ADDRESS = None  # e.g. ("127.0.0.1", 5005) to also send the notes
+# e.g. "steps.ndjson", or "liquiprism.prom" for Prometheus, written on exit
+TELEMETRY_PATH = None
 
 
 def main():
+    if REPLAY_PATH is not None:
+        liquiprism = TrajectoryReplay(REPLAY_PATH)
+    else:
+        liquiprism = Liquiprism(
+            size=SIZE,
+            random_update_rate=RANDOM_UPDATE_RATE,
+            engine=ENGINE,
+            seed=SEED,
+            activity_mode=ACTIVITY_MODE,
+        )
+        liquiprism.set_rules(RULES)
+    telemetry = (
+        TelemetryBuffer(liquiprism)
+        if TELEMETRY_PATH is not None and REPLAY_PATH is None
+        else None
+    )
+    recorder = (
+        TrajectoryRecorder(RECORD_PATH, liquiprism)
+        if RECORD_PATH is not None
+        else None
+    )
+    # Every sink gets the notes from its own thread, so a slow one never
+    # delays the MIDI port or the stepping.
+    bus = EventBus()
+    bus.add_sink(PortSink(MIDI_PORT))
+    if MIDI_FILE_PATH is not None:
+        bus.add_sink(MidiFileSink(MIDI_FILE_PATH), policy="block")
+    if UDP_ADDRESS is not None:
+        bus.add_sink(UDPSink(UDP_ADDRESS))
+    sonifier = Sonifier(liquiprism, midi_out=bus)
+    profiler = FrameProfiler()
+    scheduler = StepScheduler(
+        liquiprism,
+        sonifier,
+        step_time=STEP_TIME / 1000,
+        profiler=profiler,
+        recorder=recorder,
+    )
+    visualizer = Visualizer(scheduler.committed, profiler=profiler)
     pygame.display.set_caption("3D Liquiprism Visualizer")
-    liquiprism = Liquiprism(size=SIZE, random_update_rate=RANDOM_UPDATE_RATE)
-    visualizer = Visualizer(liquiprism)
-    sonifier = Sonifier(liquiprism)
+    scheduler.start()
 
     running = True
-    last_step_time = pygame.time.get_ticks()
     space_pressed = False
 
     while running:
         visualizer.screen.fill((0, 0, 0))
-
-        current_time = pygame.time.get_ticks()
-        if current_time - last_step_time >= STEP_TIME:
-            visualizer.liquiprism.step()
-            sonifier.update()
-            last_step_time = current_time
+        visualizer.liquiprism = scheduler.committed
+        if scheduler.error is not None:
+            # The worker stopped, close everything and then report why.
+            running = False
 
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
+            elif event.type == pygame.KEYDOWN and event.key == pygame.K_p:
+                profiler.toggle()
 
         keys = pygame.key.get_pressed()
         if keys[pygame.K_UP]:
@@ -49,12 +101,28 @@ def main():
         else:
             space_pressed = False
 
-        visualizer.render()
+        with profiler.measure("render"):
+            visualizer.render()
 
         pygame.display.flip()
         visualizer.clock.tick(60)
 
+    scheduler.stop()
+    if recorder is not None:
+        recorder.close()
+    if PROFILE_CSV is not None:
+        profiler.dump_csv(PROFILE_CSV)
+    if telemetry is not None:
+        if TELEMETRY_PATH.endswith(".prom"):
+            telemetry.to_prometheus(TELEMETRY_PATH)
+        else:
+            telemetry.to_ndjson(TELEMETRY_PATH)
+    sonifier.close()
+    bus.close()
+    liquiprism.close()
     pygame.quit()
+    if scheduler.error is not None:
+        raise scheduler.error
 
 
 if __name__ == "__main__":
@@ -0,0 +1,246 @@
+import argparse
+from collections import deque
+
+import mido
+
+from cycles import MAX_HISTORY, CycleDetector
+from liquiprism import FacePosition, Liquiprism
+from rules import FaceRules
+from sonifier import Sonifier
+from trajectory import TrajectoryRecorder, TrajectoryReplay
+
+TICKS_PER_BEAT = 480
+TEMPO = 500000  # microseconds per beat, 120 bpm
+
+
+class MidiFileOutput:
+    def __init__(
+        self,
+        step_time: int = 1000,
+        ticks_per_beat: int = TICKS_PER_BEAT,
+        tempo: int = TEMPO,
+    ):
+        self.step_time = step_time
+        self.tempo = tempo
+        self.midi_file = mido.MidiFile(type=1, ticks_per_beat=ticks_per_beat)
+
+        tempo_track = mido.MidiTrack()
+        tempo_track.append(mido.MetaMessage("set_tempo", tempo=tempo, time=0))
+        self.midi_file.tracks.append(tempo_track)
+
+        self.tracks = []
+        for face_position in FacePosition:
+            track = mido.MidiTrack()
+            track.append(
+                mido.MetaMessage(
+                    "track_name", name=face_position.name.lower(), time=0
+                )
+            )
+            self.tracks.append(track)
+            self.midi_file.tracks.append(track)
+
+        self.current_tick = 0
+        self.last_ticks = [0] * len(self.tracks)
+
+    def set_step(self, step: int) -> None:
+        # Derived from the absolute step time so rounding never accumulates.
+        self.current_tick = round(
+            mido.second2tick(
+                step * self.step_time / 1000,
+                self.midi_file.ticks_per_beat,
+                self.tempo,
+            )
+        )
+
+    def send(self, msg: mido.Message) -> None:
+        channel = msg.channel
+        self.tracks[channel].append(
+            msg.copy(time=self.current_tick - self.last_ticks[channel])
+        )
+        self.last_ticks[channel] = self.current_tick
+
+    def save(self, path: str) -> None:
+        self.midi_file.save(path)
+
+
+def render_midi(
+    path: str,
+    steps: int,
+    size: int = 7,
+    step_time: int = 1000,
+    random_update_rate: bool = True,
+    engine: str = "numpy",
+    seed: int | None = None,
+    frontmost_face: FacePosition = FacePosition.FRONT,
+    record_path: str | None = None,
+    threshold: int | None = None,
+    fast_forward: bool = False,
+    rules: dict[FacePosition, FaceRules] | FaceRules | None = None,
+    activity_mode: str = "sequential",
+) -> mido.MidiFile:
+    if fast_forward and record_path is not None:
+        raise ValueError("Skipped cycles cannot be recorded")
+
+    liquiprism = Liquiprism(
+        size=size,
+        random_update_rate=random_update_rate,
+        engine=engine,
+        seed=seed,
+        activity_mode=activity_mode,
+    )
+    liquiprism.frontmost_face = liquiprism.get_face(frontmost_face)
+    if threshold is not None:
+        liquiprism.CELL_STATE_CHANGE_THRESHOLD = threshold
+    liquiprism.set_rules(rules)
+    recorder = (
+        TrajectoryRecorder(record_path, liquiprism)
+        if record_path is not None
+        else None
+    )
+    midi_file = sonify_steps(
+        path,
+        liquiprism,
+        steps,
+        step_time,
+        recorder=recorder,
+        detector=CycleDetector(liquiprism) if fast_forward else None,
+    )
+    if recorder is not None:
+        recorder.close()
+    liquiprism.close()
+    return midi_file
+
+
+def render_trajectory_midi(
+    path: str, trajectory_path: str, step_time: int = 1000
+) -> mido.MidiFile:
+    replay = TrajectoryReplay(trajectory_path)
+    midi_file = sonify_steps(path, replay, len(replay) - 1, step_time)
+    replay.close()
+    return midi_file
+
+
+def sonify_steps(
+    path: str,
+    liquiprism: Liquiprism | TrajectoryReplay,
+    steps: int,
+    step_time: int = 1000,
+    recorder: TrajectoryRecorder | None = None,
+    detector: CycleDetector | None = None,
+) -> mido.MidiFile:
+    output = MidiFileOutput(step_time=step_time)
+    sonifier = Sonifier(liquiprism, midi_out=output)
+    recent_messages = deque(maxlen=MAX_HISTORY)
+
+    # Same timing as the live loop, the first step sounds one step time in.
+    step = 1
+    while step <= steps:
+        output.set_step(step)
+        if detector is not None:
+            period = detector.step()
+        else:
+            liquiprism.step()
+            period = None
+        if recorder is not None:
+            recorder.record()
+        messages = sonifier.step_messages()
+        sonifier.send_messages(messages)
+        recent_messages.append(messages)
+
+        cycles = (steps - step) // period if period is not None else 0
+        if cycles:
+            # The prism is in a deterministic cycle, so the next steps play
+            # the notes of its last period again and whole periods are
+            # skipped instead of computed. Velocities are drawn as the
+            # computed steps would have.
+            cycle = list(recent_messages)[-period:]
+            for offset in range(cycles * period):
+                output.set_step(step + 1 + offset)
+                sonifier.send_messages(
+                    sonifier.redraw_velocities(cycle[offset % period])
+                )
+            detector.fast_forward(cycles)
+            step += cycles * period
+        step += 1
+
+    output.set_step(steps + 1)
+    sonifier.close()
+    output.save(path)
+    return output.midi_file
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render a Liquiprism performance straight to a MIDI file."
+    )
+    parser.add_argument("path", help="output .mid file")
+    parser.add_argument("--steps", type=int, default=600)
+    parser.add_argument("--size", type=int, default=7)
+    parser.add_argument(
+        "--step-time", type=int, default=1000, help="milliseconds per step"
+    )
+    parser.add_argument(
+        "--engine", default="numpy", choices=Liquiprism.ENGINES
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--fixed-update-rate",
+        action="store_true",
+        help="update every face on every step",
+    )
+    parser.add_argument(
+        "--frontmost-face",
+        default=FacePosition.FRONT.name.lower(),
+        choices=[face_position.name.lower() for face_position in FacePosition],
+    )
+    parser.add_argument(
+        "--threshold",
+        type=int,
+        default=None,
+        help="stimulated cells per step before the conventional rule is used",
+    )
+    parser.add_argument(
+        "--activity-mode",
+        default="sequential",
+        choices=Liquiprism.ACTIVITY_MODES,
+        help="how a step chooses between the stochastic and conventional rule",
+    )
+    parser.add_argument(
+        "--fast-forward",
+        action="store_true",
+        help="skip whole cycles once the prism becomes periodic",
+    )
+    parser.add_argument(
+        "--record", default=None, help="also record the steps to this file"
+    )
+    parser.add_argument(
+        "--replay",
+        default=None,
+        help="sonify a recorded trajectory instead of running the prism",
+    )
+    args = parser.parse_args()
+
+    if args.replay is not None:
+        render_trajectory_midi(
+            args.path, args.replay, step_time=args.step_time
+        )
+        return
+
+    render_midi(
+        args.path,
+        steps=args.steps,
+        size=args.size,
+        step_time=args.step_time,
+        random_update_rate=not args.fixed_update_rate,
+        engine=args.engine,
+        seed=args.seed,
+        frontmost_face=FacePosition[args.frontmost_face.upper()],
+        record_path=args.record,
+        threshold=args.threshold,
+        activity_mode=args.activity_mode,
+        fast_forward=args.fast_forward,
+    )
+
+
+if __name__ == "__main__":
+    main()
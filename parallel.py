@@ -0,0 +1,299 @@
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from liquiprism import (
+    FacePosition,
+    RelativeFacePosition,
+    apply_rule_table,
+    count_alive_neighbors,
+    get_topology,
+)
+from rng import PrismRNG, face_generator
+from rules import (
+    CONVENTIONAL,
+    LEGACY_TABLE,
+    STIMULUS,
+    STOCHASTIC,
+)
+
+
+def shared_layout(size: int) -> dict[str, tuple[tuple[int], type]]:
+    face_shape = (len(FacePosition), size, size)
+    return {
+        "alive": (face_shape, bool),
+        "stimulated": (face_shape, bool),
+        "will_be_alive": (face_shape, bool),
+        "conventional": (face_shape, bool),
+        "row_counts": ((len(FacePosition) * size,), np.int64),
+    }
+
+
+def split_rows(size: int, n_shards: int) -> list[list[tuple[int]]]:
+    # Splits the 6 * size face rows into contiguous shards of
+    # (face_index, start_row, stop_row) segments that never cross a seam.
+    bounds = np.linspace(0, len(FacePosition) * size, n_shards + 1).astype(int)
+    shards = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        segments = []
+        row = start
+        while row < stop:
+            face_index, i = divmod(int(row), size)
+            end = min(int(stop), (face_index + 1) * size)
+            segments.append((face_index, i, end - face_index * size))
+            row = end
+        shards.append(segments)
+    return shards
+
+
+def pad_rows(alive, topology, face_index: int, start: int, stop: int):
+    # Like CubeTopology.pad for rows start..stop of a single face, reading
+    # only the seam rows and columns this tile needs from the other faces.
+    size = topology.size
+    flat = alive.reshape(-1)
+    padded = np.zeros((stop - start + 2, size + 2), dtype=bool)
+
+    rows = np.arange(start - 1, stop + 1)
+    inside = (rows >= 0) & (rows < size)
+    padded[inside, 1:-1] = alive[face_index, rows[inside]]
+    if start == 0:
+        padded[0, 1:-1] = flat[
+            topology.seams[RelativeFacePosition.TOP][face_index]
+        ]
+    if stop == size:
+        padded[-1, 1:-1] = flat[
+            topology.seams[RelativeFacePosition.BOTTOM][face_index]
+        ]
+    padded[inside, 0] = flat[
+        topology.seams[RelativeFacePosition.LEFT][face_index][rows[inside]]
+    ]
+    padded[inside, -1] = flat[
+        topology.seams[RelativeFacePosition.RIGHT][face_index][rows[inside]]
+    ]
+    return padded
+
+
+def attach(names: dict[str, str], size: int):
+    buffers = {
+        key: shared_memory.SharedMemory(name=name)
+        for key, name in names.items()
+    }
+    arrays = {
+        key: np.ndarray(shape, dtype=dtype, buffer=buffers[key].buf)
+        for key, (shape, dtype) in shared_layout(size).items()
+    }
+    return buffers, arrays
+
+
+def evaluate_segment(
+    arrays, topology, segment, frontmost, rule_table, face_state
+):
+    face_index, start, stop = segment
+    size = topology.size
+    alive = arrays["alive"][face_index, start:stop]
+    # Jump the face's stream to this tile's first cell, so the draws are the
+    # ones a single process would make for the whole face.
+    generator = face_generator(face_state)
+    generator.bit_generator.advance(start * size)
+    uniforms = generator.random((stop - start, size))
+    padded = pad_rows(arrays["alive"], topology, face_index, start, stop)
+    cells = (alive, count_alive_neighbors(padded), padded[2:, 1:-1])
+
+    if face_index == frontmost:
+        will_be_alive = apply_rule_table(
+            rule_table[face_index, STIMULUS], *cells, uniforms
+        )
+        conventional = will_be_alive
+    else:
+        will_be_alive = apply_rule_table(
+            rule_table[face_index, STOCHASTIC], *cells, uniforms
+        )
+        conventional = apply_rule_table(
+            rule_table[face_index, CONVENTIONAL], *cells, uniforms
+        )
+
+    arrays["will_be_alive"][face_index, start:stop] = will_be_alive
+    arrays["conventional"][face_index, start:stop] = conventional
+    arrays["row_counts"][
+        face_index * size + start : face_index * size + stop
+    ] = (will_be_alive & ~alive).sum(axis=-1)
+
+
+def commit_segment(arrays, size, segment, frontmost, boundary) -> int:
+    face_index, start, stop = segment
+    alive = arrays["alive"][face_index, start:stop]
+    will_be_alive = arrays["will_be_alive"][face_index, start:stop]
+    if boundary is not None and face_index != frontmost:
+        cell_index = (
+            np.arange(start * size, stop * size).reshape(-1, size)
+            + face_index * size**2
+        )
+        will_be_alive = np.where(
+            cell_index > boundary,
+            arrays["conventional"][face_index, start:stop],
+            will_be_alive,
+        )
+
+    stimulated = will_be_alive & ~alive
+    arrays["stimulated"][face_index, start:stop] = stimulated
+    alive[:] = will_be_alive
+    return int(stimulated.sum())
+
+
+def run_worker(names: dict[str, str], size: int, segments, connection):
+    buffers, arrays = attach(names, size)
+    topology = get_topology(size)
+    while True:
+        command, args = connection.recv()
+        if command == "evaluate":
+            due, frontmost, rule_table, face_states = args
+            for segment in segments:
+                if due[segment[0]]:
+                    evaluate_segment(
+                        arrays,
+                        topology,
+                        segment,
+                        frontmost,
+                        rule_table,
+                        face_states[segment[0]],
+                    )
+                else:
+                    face_index, start, stop = segment
+                    arrays["row_counts"][
+                        face_index * size + start : face_index * size + stop
+                    ] = 0
+            connection.send(None)
+        elif command == "commit":
+            due, frontmost, boundary = args
+            connection.send(
+                sum(
+                    commit_segment(arrays, size, segment, frontmost, boundary)
+                    for segment in segments
+                    if due[segment[0]]
+                )
+            )
+        else:
+            break
+
+    del arrays
+    for buffer in buffers.values():
+        buffer.close()
+
+
+def shutdown(processes, connections, buffers) -> None:
+    for connection in connections:
+        try:
+            connection.send(("close", None))
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+    for buffer in buffers.values():
+        try:
+            buffer.close()
+        except BufferError:
+            # Someone still holds a view on the buffer, the segment is freed
+            # once they release it.
+            pass
+        buffer.unlink()
+
+
+class ShardedState:
+    def __init__(
+        self,
+        alive: np.ndarray,
+        update_rates: np.ndarray,
+        rng: PrismRNG,
+        workers: int | None = None,
+    ):
+        self.size = alive.shape[-1]
+        self.update_rates = update_rates
+        self.rng = rng
+        self.topology = get_topology(self.size)
+        self.workers = workers or os.cpu_count() or 1
+
+        self.buffers = {}
+        arrays = {}
+        for key, (shape, dtype) in shared_layout(self.size).items():
+            buffer = shared_memory.SharedMemory(
+                create=True,
+                size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize),
+            )
+            self.buffers[key] = buffer
+            arrays[key] = np.ndarray(shape, dtype=dtype, buffer=buffer.buf)
+            arrays[key][:] = 0
+        arrays["alive"][:] = alive
+        self.arrays = arrays
+        self.alive = arrays["alive"]
+        self.stimulated = arrays["stimulated"]
+
+        names = {key: buffer.name for key, buffer in self.buffers.items()}
+        self.connections = []
+        self.processes = []
+        for segments in split_rows(self.size, self.workers):
+            parent_connection, child_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_worker,
+                args=(names, self.size, segments, child_connection),
+                daemon=True,
+            )
+            process.start()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+
+        self._finalizer = weakref.finalize(
+            self, shutdown, self.processes, self.connections, self.buffers
+        )
+
+    def close(self) -> None:
+        self.alive = self.alive.copy()
+        self.stimulated = self.stimulated.copy()
+        self.arrays = {}
+        self._finalizer()
+
+    def broadcast(self, command: str, args) -> list:
+        for connection in self.connections:
+            connection.send((command, args))
+        return [connection.recv() for connection in self.connections]
+
+    def boundary(self, threshold: int) -> int | None:
+        # Flat index of the threshold-th stimulated cell, every later cell
+        # follows the conventional rule, as in the sequential engines.
+        if threshold <= 0:
+            return -1
+
+        row_counts = self.arrays["row_counts"]
+        stimulated_before = np.cumsum(row_counts)
+        if stimulated_before[-1] < threshold:
+            return None
+
+        row = int(np.searchsorted(stimulated_before, threshold))
+        face_index, i = divmod(row, self.size)
+        row_stimulated = np.flatnonzero(
+            self.arrays["will_be_alive"][face_index, i]
+            & ~self.alive[face_index, i]
+        )
+        remaining = threshold - (stimulated_before[row] - row_counts[row])
+        return row * self.size + int(row_stimulated[remaining - 1])
+
+    def evolve(
+        self,
+        due: np.ndarray,
+        frontmost: int,
+        threshold: int,
+        rule_table: np.ndarray = LEGACY_TABLE,
+    ) -> int:
+        face_states = {
+            face_index: self.rng.face_state(face_index)
+            for face_index in np.flatnonzero(due)
+        }
+        self.broadcast("evaluate", (due, frontmost, rule_table, face_states))
+        for face_index in face_states:
+            self.rng.skip(face_index, self.size**2)
+        boundary = self.boundary(threshold)
+        return sum(self.broadcast("commit", (due, frontmost, boundary)))
@@ -0,0 +1,101 @@
+import csv
+import time
+from contextlib import nullcontext
+
+import numpy as np
+
+PROFILE_HISTORY = 1000
+PHASES = ("step", "sonify", "midi send", "render")
+PERCENTILES = (50, 95, 99)
+
+
+class PhaseTimer:
+    def __init__(self, profiler: "FrameProfiler", phase: str):
+        self.profiler = profiler
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.phase, time.perf_counter_ns() - self.start)
+
+
+class FrameProfiler:
+    def __init__(
+        self,
+        phases: tuple[str] = PHASES,
+        history: int = PROFILE_HISTORY,
+        enabled: bool = False,
+    ):
+        self.enabled = enabled
+        self.history = history
+        self.samples = {
+            phase: np.zeros(history, dtype=np.int64) for phase in phases
+        }
+        self.counts = dict.fromkeys(phases, 0)
+        self.timers = {phase: PhaseTimer(self, phase) for phase in phases}
+        self._disabled = nullcontext()
+
+    def __repr__(self):
+        return f"FrameProfiler(enabled={self.enabled})"
+
+    def toggle(self) -> None:
+        self.enabled = not self.enabled
+
+    def measure(self, phase: str):
+        # Every phase is timed from a single thread, so its timer can be
+        # reused instead of allocating one per measurement.
+        if not self.enabled:
+            return self._disabled
+        return self.timers[phase]
+
+    def record(self, phase: str, elapsed_ns: int) -> None:
+        count = self.counts[phase]
+        self.samples[phase][count % self.history] = elapsed_ns
+        self.counts[phase] = count + 1
+
+    def recent(self, phase: str) -> np.ndarray:
+        return self.samples[phase][: min(self.counts[phase], self.history)]
+
+    def percentiles(self, phase: str) -> np.ndarray | None:
+        samples = self.recent(phase)
+        if not len(samples):
+            return None
+        return np.percentile(samples, PERCENTILES) / 1e6
+
+    def summary(self) -> list[str]:
+        lines = []
+        for phase in self.samples:
+            percentiles = self.percentiles(phase)
+            if percentiles is None:
+                lines.append(f"{phase:<10} -")
+                continue
+            lines.append(
+                f"{phase:<10}"
+                + "".join(
+                    f" p{percentile} {value:7.2f}"
+                    for percentile, value in zip(PERCENTILES, percentiles)
+                )
+                + " ms"
+            )
+        return lines
+
+    def dump_csv(self, path: str) -> None:
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(
+                ["phase", "samples"]
+                + [f"p{percentile}_ms" for percentile in PERCENTILES]
+                + ["max_ms"]
+            )
+            for phase in self.samples:
+                samples = self.recent(phase)
+                if not len(samples):
+                    writer.writerow([phase, 0] + [""] * (len(PERCENTILES) + 1))
+                    continue
+                writer.writerow(
+                    [phase, self.counts[phase]]
+                    + [f"{value:.4f}" for value in self.percentiles(phase)]
+                    + [f"{samples.max() / 1e6:.4f}"]
+                )
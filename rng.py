@@ -0,0 +1,107 @@
+import numpy as np
+
+N_FACES = 6
+# Above one wanted draw in this many, drawing the whole batch is cheaper than
+# jumping the stream to each of them.
+SPARSE_DRAW_RATIO = 200
+
+
+class PrismRNG:
+    def __init__(
+        self, seed: int | np.random.SeedSequence | None = None, streams=N_FACES
+    ):
+        self.seed_sequence = (
+            seed
+            if isinstance(seed, np.random.SeedSequence)
+            else np.random.SeedSequence(seed)
+        )
+        setup_seed, *face_seeds, notes_seed = self.seed_sequence.spawn(
+            streams + 2
+        )
+        # One stream for construction-time choices (update rates) and one
+        # independent stream per face, so faces can draw on their own.
+        self.setup = np.random.Generator(np.random.PCG64(setup_seed))
+        self.faces = [
+            np.random.Generator(np.random.PCG64(face_seed))
+            for face_seed in face_seeds
+        ]
+        # For the sonifier's note velocities, which are not part of the
+        # prism's state and never touch the other streams.
+        self.notes = np.random.Generator(np.random.PCG64(notes_seed))
+
+    def __repr__(self):
+        return f"PrismRNG(entropy={self.seed_sequence.entropy})"
+
+    def update_rates(
+        self, random_update_rate: bool, count: int | None = None
+    ) -> np.ndarray:
+        # One rate per face unless count says otherwise.
+        count = len(self.faces) if count is None else count
+        if not random_update_rate:
+            return np.ones(count, dtype=int)
+
+        return self.setup.integers(1, 4, size=count)
+
+    def uniforms(self, face_index: int, shape, out=None) -> np.ndarray:
+        return self.faces[face_index].random(shape, out=out)
+
+    def initial_states(self, size: int, probability: float = 0.5):
+        return np.stack(
+            [
+                self.uniforms(face_index, (size, size)) < probability
+                for face_index in range(len(self.faces))
+            ]
+        )
+
+    def step_uniforms(
+        self, due: np.ndarray, size: int, out: np.ndarray | None = None
+    ) -> np.ndarray:
+        # One (size, size) batch per due face; faces that are not updated
+        # this step do not consume their stream.
+        if out is None:
+            out = np.ones((len(self.faces), size, size))
+        for face_index in np.flatnonzero(due):
+            self.uniforms(face_index, None, out=out[face_index])
+        return out
+
+    def sparse_uniforms(
+        self, face_index: int, positions: np.ndarray, count: int
+    ) -> np.ndarray:
+        # The draws at the sorted positions out of the next count draws of
+        # a face, leaving its stream where drawing all of them would.
+        if len(positions) * SPARSE_DRAW_RATIO >= count:
+            return self.uniforms(face_index, count)[positions]
+
+        generator = self.faces[face_index]
+        uniforms = np.empty(len(positions))
+        drawn = 0
+        for k, position in enumerate(positions.tolist()):
+            generator.bit_generator.advance(position - drawn)
+            uniforms[k] = generator.random()
+            drawn = position + 1
+        generator.bit_generator.advance(count - drawn)
+        return uniforms
+
+    def skip(self, face_index: int, count: int) -> None:
+        # Each float64 draw consumes exactly one PCG64 output.
+        self.faces[face_index].bit_generator.advance(count)
+
+    def face_state(self, face_index: int) -> dict:
+        return self.faces[face_index].bit_generator.state
+
+    def get_state(self) -> dict:
+        return {
+            "setup": self.setup.bit_generator.state,
+            "faces": [face.bit_generator.state for face in self.faces],
+        }
+
+    def set_state(self, state: dict) -> None:
+        self.setup.bit_generator.state = state["setup"]
+        for face, face_state in zip(self.faces, state["faces"]):
+            face.bit_generator.state = face_state
+
+
+def face_generator(state: dict) -> np.random.Generator:
+    generator = np.random.Generator(np.random.PCG64())
+    generator.bit_generator.state = state
+    return generator
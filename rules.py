@@ -0,0 +1,158 @@
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+from rng import N_FACES
+
+STOCHASTIC, CONVENTIONAL, STIMULUS = range(3)
+MAX_NEIGHBORS = 8
+# A cell's rule input is coded as alive * 18 + alive_neighbors * 2 + below.
+N_CODES = 2 * (MAX_NEIGHBORS + 1) * 2
+
+
+@dataclass(frozen=True)
+class FaceRules:
+    survival: frozenset[int] = frozenset({2, 3})
+    birth: frozenset[int] = frozenset(range(4, MAX_NEIGHBORS + 1))
+    stochastic_birth: float = 1 / 3  # when the cell below is alive
+    stimulus: float = 0.2
+
+
+LEGACY_RULES = FaceRules()
+
+
+def compile_face_rules(face_rules: FaceRules) -> np.ndarray:
+    # Probability of being alive after an update, indexed by
+    # (regime, alive, alive_neighbors, below alive). 0 and 1 are certain
+    # since the uniforms are drawn from [0, 1).
+    for counts in (face_rules.survival, face_rules.birth):
+        if not all(0 <= count <= MAX_NEIGHBORS for count in counts):
+            raise ValueError(
+                f"Neighbor counts must be between 0 and {MAX_NEIGHBORS}"
+            )
+    for probability in (face_rules.stochastic_birth, face_rules.stimulus):
+        if not 0 <= probability <= 1:
+            raise ValueError(f"Invalid probability {probability}")
+
+    counts = np.arange(MAX_NEIGHBORS + 1)
+    survives = np.isin(counts, list(face_rules.survival))[:, None]
+    table = np.zeros((3, 2, MAX_NEIGHBORS + 1, 2))
+    table[STOCHASTIC, 1] = survives
+    table[STOCHASTIC, 0, :, 1] = face_rules.stochastic_birth
+    table[CONVENTIONAL, 1] = survives
+    table[CONVENTIONAL, 0] = np.isin(counts, list(face_rules.birth))[:, None]
+    table[STIMULUS, 1] = 1
+    table[STIMULUS, 0] = face_rules.stimulus
+    return table
+
+
+def compile_rules(
+    rules: dict["FacePosition", FaceRules] | FaceRules | None = None,
+) -> np.ndarray:
+    # (6, 3, N_CODES) lookup table, faces missing from rules keep the
+    # legacy rules.
+    if rules is None:
+        rules = {}
+    if isinstance(rules, FaceRules):
+        rules = {face_index: rules for face_index in range(N_FACES)}
+    by_index = {
+        getattr(face_position, "value", face_position): face_rules
+        for face_position, face_rules in rules.items()
+    }
+    table = np.stack(
+        [
+            compile_face_rules(by_index.get(face_index, LEGACY_RULES))
+            for face_index in range(N_FACES)
+        ]
+    ).reshape(N_FACES, 3, N_CODES)
+    table.flags.writeable = False
+    return table
+
+
+def rule_code(alive: bool, alive_neighbors: int, bellow_alive: bool) -> int:
+    return (
+        int(alive) * (N_CODES // 2) + alive_neighbors * 2 + int(bellow_alive)
+    )
+
+
+def rule_codes(alive, alive_neighbors, bellow_alive) -> np.ndarray:
+    return (
+        alive.astype(np.uint8) * (N_CODES // 2)
+        + alive_neighbors.astype(np.uint8) * 2
+        + bellow_alive
+    )
+
+
+def count_runs(count_set: frozenset[int]) -> list[tuple[int]]:
+    # (first, last) of each run of consecutive counts in count_set.
+    runs = []
+    for count in sorted(count_set):
+        if runs and runs[-1][1] == count - 1:
+            runs[-1] = (runs[-1][0], count)
+        else:
+            runs.append((count, count))
+    return runs
+
+
+@lru_cache(maxsize=None)
+def rule_terms(row: tuple[float]) -> list[tuple]:
+    # Groups the codes of a row of N_CODES probabilities by probability, as
+    # (probability, [(alive, below alive or None for either, counts)]), so
+    # engines can evaluate a row with a few comparisons instead of a lookup
+    # per cell. Codes that are never alive next are left out.
+    terms = []
+    for probability in sorted(set(row) - {0.0}):
+        codes = {code for code, p in enumerate(row) if p == probability}
+        group = []
+        for alive in (False, True):
+            count_sets = [
+                frozenset(
+                    count
+                    for count in range(MAX_NEIGHBORS + 1)
+                    if rule_code(alive, count, below) in codes
+                )
+                for below in (False, True)
+            ]
+            if count_sets[0] == count_sets[1]:
+                splits = [(None, count_sets[0])]
+            else:
+                splits = [(False, count_sets[0]), (True, count_sets[1])]
+            group.extend(
+                (alive, below, count_set)
+                for below, count_set in splits
+                if count_set
+            )
+        terms.append((probability, group))
+    return terms
+
+
+def row_runs(table: np.ndarray) -> list[tuple[tuple[float], slice]]:
+    # Runs of consecutive faces of a (faces, N_CODES) table sharing a row,
+    # so each run can be evaluated on a view of the faces.
+    runs = []
+    for face_index, row in enumerate(map(tuple, table.tolist())):
+        if runs and runs[-1][0] == row:
+            runs[-1][2] = face_index + 1
+        else:
+            runs.append([row, face_index, face_index + 1])
+    return [(row, slice(start, stop)) for row, start, stop in runs]
+
+
+def regime_tables(
+    rule_table: np.ndarray, frontmost: np.ndarray
+) -> tuple[np.ndarray]:
+    # rule_table is (..., 6, 3, N_CODES), returns the (..., 6, N_CODES)
+    # tables of the rule each face follows before and after the activity
+    # threshold, the frontmost face always follows the stimulus rule.
+    is_frontmost = (np.arange(N_FACES) == np.asarray(frontmost)[..., None])[
+        ..., None
+    ]
+    stimulus = rule_table[..., STIMULUS, :]
+    return (
+        np.where(is_frontmost, stimulus, rule_table[..., STOCHASTIC, :]),
+        np.where(is_frontmost, stimulus, rule_table[..., CONVENTIONAL, :]),
+    )
+
+
+LEGACY_TABLE = compile_rules()
@@ -0,0 +1,127 @@
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import mido
+
+from liquiprism import FacePosition, Liquiprism, PrismFrame
+from profiler import FrameProfiler
+from sonifier import Sonifier
+from trajectory import TrajectoryRecorder
+
+LOOKAHEAD_STEPS = 4
+SPIN_TIME = 0.002  # seconds spent busy-waiting before each event
+SWITCH_INTERVAL = 0.0005
+LATENESS_HISTORY = 1000
+
+
+@dataclass
+class ScheduledStep:
+    time: float
+    messages: list[mido.Message]
+    frame: PrismFrame
+
+
+class StepScheduler:
+    def __init__(
+        self,
+        liquiprism: Liquiprism,
+        sonifier: Sonifier,
+        step_time: float = 1.0,
+        lookahead: int = LOOKAHEAD_STEPS,
+        profiler: FrameProfiler | None = None,
+        recorder: TrajectoryRecorder | None = None,
+    ):
+        self.liquiprism = liquiprism
+        self.sonifier = sonifier
+        self.step_time = step_time
+        self.profiler = profiler or FrameProfiler()
+        self.recorder = recorder
+        self.buffer = queue.Queue(maxsize=lookahead)
+        # The frontmost face asked for by the renderer, applied by the
+        # worker between steps so a step never sees it change.
+        self.frontmost = None
+        self.committed = PrismFrame(liquiprism, self.request_frontmost)
+        self.lateness = deque(maxlen=LATENESS_HISTORY)
+        self.error = None
+
+        self._stopped = threading.Event()
+        self._threads = []
+        self._switch_interval = sys.getswitchinterval()
+
+    def start(self) -> None:
+        # A shorter switch interval lets the clock thread take the GIL back
+        # from the renderer and the step worker close to its deadline.
+        sys.setswitchinterval(SWITCH_INTERVAL)
+        self.start_time = time.perf_counter()
+        self._threads = [
+            threading.Thread(target=self._run_worker, daemon=True),
+            threading.Thread(target=self._run_clock, daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+        sys.setswitchinterval(self._switch_interval)
+
+    def request_frontmost(self, face_position: FacePosition) -> None:
+        # Takes effect on the next step that is computed.
+        self.frontmost = face_position
+
+    def _run_worker(self) -> None:
+        step = 1
+        try:
+            while not self._stopped.is_set():
+                if self.frontmost is not None:
+                    self.liquiprism.frontmost_face = self.liquiprism.get_face(
+                        self.frontmost
+                    )
+                with self.profiler.measure("step"):
+                    self.liquiprism.step()
+                if self.recorder is not None:
+                    self.recorder.record()
+                with self.profiler.measure("sonify"):
+                    messages = self.sonifier.step_messages()
+                scheduled_step = ScheduledStep(
+                    time=self.start_time + step * self.step_time,
+                    messages=messages,
+                    frame=PrismFrame(self.liquiprism, self.request_frontmost),
+                )
+                while not self._stopped.is_set():
+                    try:
+                        self.buffer.put(scheduled_step, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+                step += 1
+        except Exception as error:
+            self.error = error
+            self._stopped.set()
+
+    def _run_clock(self) -> None:
+        while not self._stopped.is_set():
+            try:
+                scheduled_step = self.buffer.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+            # Sleep until shortly before the deadline, then spin so the
+            # messages leave within a fraction of a millisecond of it.
+            # Deadlines are absolute, so lateness never accumulates.
+            remaining = scheduled_step.time - time.perf_counter()
+            if remaining > SPIN_TIME:
+                self._stopped.wait(remaining - SPIN_TIME)
+            while time.perf_counter() < scheduled_step.time:
+                if self._stopped.is_set():
+                    return
+
+            with self.profiler.measure("midi send"):
+                self.sonifier.send_messages(scheduled_step.messages)
+            self.lateness.append(time.perf_counter() - scheduled_step.time)
+            self.committed = scheduled_step.frame
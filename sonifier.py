@@ -1,85 +1,299 @@
-from random import randint
+import numpy as np
 
-import mido
-
-from liquiprism import Face, FacePosition, Liquiprism
+from liquiprism import FacePosition, Liquiprism, StepRecord
+from rng import PrismRNG
 
 MIDI_PORT = "IAC Driver Bus 1"
+BASE_PITCHES = {
+    FacePosition.BOTTOM: 24,
+    FacePosition.TOP: 84,
+    FacePosition.FRONT: 48,
+    FacePosition.BACK: 60,
+    FacePosition.LEFT: 36,
+    FacePosition.RIGHT: 72,
+}
+SCALES = {
+    "major": (0, 2, 4, 5, 7, 9, 11),
+    "minor": (0, 2, 3, 5, 7, 8, 10),
+    "pentatonic": (0, 2, 4, 7, 9),
+    "chromatic": tuple(range(12)),
+}
+MAX_PITCH = 127
+VOICES = 6  # notes sounding per face
+PRIORITIES = ("scan", "bottom", "center")
+
+
+def pitch_grids(
+    size: int,
+    scale: tuple[int] = SCALES["major"],
+    base_pitches: dict[FacePosition, int] = BASE_PITCHES,
+) -> np.ndarray:
+    # (6, size, size) pitches. Each row climbs the scale from its face's
+    # base pitch, one semitone higher than the row below it, and pitches
+    # above the MIDI range are folded down by octaves.
+    octaves, degrees = np.divmod(np.arange(size), len(scale))
+    offsets = (
+        (size - 1 - np.arange(size))[:, None]
+        + np.asarray(scale)[degrees]
+        + 12 * octaves
+    )
+    pitches = (
+        np.array([base_pitches[position] for position in FacePosition])[
+            :, None, None
+        ]
+        + offsets
+    )
+    return np.where(
+        pitches > MAX_PITCH,
+        pitches - 12 * ((pitches - MAX_PITCH + 11) // 12),
+        pitches,
+    )
+
+
+def priority_keys(priority: str | np.ndarray, size: int) -> np.ndarray:
+    # Sort keys of the flat cells, every face's cells come before the next
+    # face's and cells with lower keys get a voice first. Ties are broken
+    # in scan order.
+    if isinstance(priority, str):
+        i, j = np.indices((size, size))
+        if priority == "scan":
+            priority = np.zeros((size, size))
+        elif priority == "bottom":
+            priority = i
+        elif priority == "center":
+            priority = -np.hypot(i - (size - 1) / 2, j - (size - 1) / 2)
+        else:
+            raise ValueError(
+                f"Unknown priority {priority!r}, expected one of "
+                f"{PRIORITIES} or an array"
+            )
+    priority = np.broadcast_to(priority, (len(FacePosition), size, size))
+
+    order = np.argsort(
+        -priority.reshape(len(FacePosition), -1), axis=-1, kind="stable"
+    )
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(size**2), axis=-1)
+    return (ranks + np.arange(len(FacePosition))[:, None] * size**2).ravel()
+
+
+class VoiceAllocator:
+    def __init__(
+        self,
+        size: int,
+        voices: int = VOICES,
+        priority: str | np.ndarray = "scan",
+    ):
+        self.size = size
+        self.voices = voices
+        self.keys = priority_keys(priority, size)
+
+    def select(self, cells: np.ndarray) -> np.ndarray:
+        # Flat indices of the voices stimulated cells with the highest
+        # priority on each face, or all of them if there are fewer.
+        cells = cells[np.argsort(self.keys[cells])]
+        faces = cells // self.size**2
+        rank_on_face = np.arange(len(cells)) - np.searchsorted(faces, faces)
+        return cells[rank_on_face < self.voices]
 
 
 class Sonifier:
-    def __init__(self, liquiprism: Liquiprism, midi_port=MIDI_PORT):
+    def __init__(
+        self,
+        liquiprism: Liquiprism,
+        midi_port=MIDI_PORT,
+        midi_out=None,
+        voices: int = VOICES,
+        priority: str | np.ndarray = "scan",
+        scale: str | tuple[int] = "major",
+        velocities: np.ndarray | None = None,
+        rng: np.random.Generator | None = None,
+    ):
         self.liquiprism = liquiprism
-        self.midi_out = mido.open_output(midi_port)
-        self.note_threshold = 5
-        self.pitch_grids = self.create_pitch_grids()
-
-    def create_pitch_grids(self) -> dict[FacePosition, list[list[int]]]:
-        pitch_grids = {}
-        base_pitches = {
-            FacePosition.BOTTOM: 24,
-            FacePosition.TOP: 84,
-            FacePosition.FRONT: 48,
-            FacePosition.BACK: 60,
-            FacePosition.LEFT: 36,
-            FacePosition.RIGHT: 72,
+        self.midi_port = midi_port
+        self.owns_port = midi_out is None
+        # Without midi_out the port is opened on the first message sent, so
+        # a sonifier can be built where the port does not exist.
+        self.midi_out = midi_out
+        # Notes sounding after the last computed step, and notes actually
+        # switched on at the output. These differ while computed steps wait
+        # to be sent, and only the latter must be released.
+        self.sounding_notes = {
+            face_position.value: set() for face_position in FacePosition
         }
+        self.sent_notes = {
+            face_position.value: set() for face_position in FacePosition
+        }
+        size = liquiprism.size
+        self.pitches = pitch_grids(size, SCALES.get(scale, scale))
+        # Per cell note on velocities, random ones are drawn when None.
+        self.velocities = (
+            np.broadcast_to(velocities, self.pitches.shape)
+            if velocities is not None
+            else None
+        )
+        # Random velocities come from the prism's notes stream when it has
+        # one, so seeded runs sound the same every time.
+        prism_rng = getattr(liquiprism, "rng", None)
+        if rng is None:
+            rng = (
+                prism_rng.notes
+                if isinstance(prism_rng, PrismRNG)
+                else np.random.default_rng()
+            )
+        self.rng = rng
+        self.allocator = VoiceAllocator(size, voices, priority)
+        # A prism that reports its steps hands over the cells each step
+        # stimulated, and only the faces it updated are sonified again.
+        # Other prisms, such as frames or replays, are scanned every time.
+        self.face_cells = None
+        if hasattr(liquiprism, "subscribe"):
+            cells = np.flatnonzero(liquiprism.get_stimulated_array())
+            self.face_cells = self.split_faces(cells)
+            self.updated = np.ones(len(FacePosition), dtype=bool)
+            liquiprism.subscribe(self.observe)
 
-        major_scale_intervals = [0, 2, 4, 5, 7, 9, 11]
-        major_scale_notes = len(major_scale_intervals)
-
-        for face_position, base_pitch in base_pitches.items():
-            pitch_grid = []
-            for row in range(major_scale_notes):
-                scale_base = base_pitch + (major_scale_notes - 1 - row)
-                row_pitches = [
-                    scale_base + major_scale_intervals[col % major_scale_notes]
-                    for col in range(major_scale_notes)
-                ]
-                pitch_grid.append(row_pitches)
-            pitch_grids[face_position] = pitch_grid
+    def split_faces(self, cells: np.ndarray) -> list[np.ndarray]:
+        bounds = np.arange(1, len(FacePosition)) * self.liquiprism.size**2
+        return np.split(cells, np.searchsorted(cells, bounds))
 
-        return pitch_grids
+    def observe(self, record: StepRecord) -> None:
+        face_cells = self.split_faces(record.stimulated)
+        for face_index in np.flatnonzero(record.updated):
+            self.face_cells[face_index] = face_cells[face_index]
+        self.updated |= record.updated
 
     def update(self) -> None:
-        for face_position in FacePosition:
-            face = self.liquiprism.get_face(face_position)
-            midi_channel = face_position.value
-            self.sonify_face(
-                face, midi_channel, self.pitch_grids[face_position]
+        self.send_messages(self.step_messages())
+
+    def step_messages(self) -> list["mido.Message"]:
+        # The notes of faces that were not updated since the last call keep
+        # sounding, so they need no messages.
+        if self.face_cells is None:
+            updated = np.ones(len(FacePosition), dtype=bool)
+            cells = np.flatnonzero(self.liquiprism.get_stimulated_array())
+        else:
+            updated, self.updated = self.updated, np.zeros_like(self.updated)
+            cells = np.concatenate(self.face_cells)
+            cells = cells[updated[cells // self.liquiprism.size**2]]
+        cells = self.allocator.select(cells)
+        faces = (cells // self.liquiprism.size**2).tolist()
+        pitches = self.pitches.ravel()[cells].tolist()
+        velocities = (
+            self.velocities.ravel()[cells].tolist()
+            if self.velocities is not None
+            else [None] * len(cells)
+        )
+
+        # Cells sharing a pitch sound it once, at the highest velocity.
+        face_notes = [{} for _ in FacePosition]
+        for face_index, pitch, velocity in zip(faces, pitches, velocities):
+            notes = face_notes[face_index]
+            if velocity is None or notes.get(pitch) is None:
+                notes.setdefault(pitch, velocity)
+            else:
+                notes[pitch] = max(notes[pitch], velocity)
+
+        messages = []
+        for midi_channel in np.flatnonzero(updated).tolist():
+            messages.extend(
+                self.face_messages(midi_channel, face_notes[midi_channel])
             )
+        return messages
 
-    def sonify_face(
-        self, face: Face, midi_channel: int, pitch_grid: list[list[int]]
-    ) -> None:
-        played_pitches = 0
-        for i in range(self.liquiprism.size):
-            for j in range(self.liquiprism.size):
-                cell = face.get_cell((i, j))
-                if cell.stimulated and played_pitches <= self.note_threshold:
-                    pitch = pitch_grid[i][j]
-                    self.play_note_on(midi_channel, pitch)
-                    played_pitches += 1
-                else:
-                    pitch = pitch_grid[i][j]
-                    self.play_note_off(midi_channel, pitch)
+    def face_messages(
+        self, midi_channel: int, notes: dict[int, int | None]
+    ) -> list["mido.Message"]:
+        # Only notes whose state changes are sent, notes that keep sounding
+        # are held instead of being retriggered.
+        pitches = set(notes)
+        sounding_notes = self.sounding_notes[midi_channel]
+        messages = [
+            self.note_off_message(midi_channel, pitch)
+            for pitch in sorted(sounding_notes - pitches)
+        ] + [
+            self.note_on_message(midi_channel, pitch, notes[pitch])
+            for pitch in sorted(pitches - sounding_notes)
+        ]
+        self.sounding_notes[midi_channel] = pitches
+        return messages
 
-    def play_note_on(self, channel: int, pitch: int) -> None:
-        msg = mido.Message(
+    def send_messages(self, messages: list["mido.Message"]) -> None:
+        if messages and self.midi_out is None:
+            import mido
+
+            self.midi_out = mido.open_output(self.midi_port)
+        for msg in messages:
+            self.midi_out.send(msg)
+            if msg.type == "note_on":
+                self.sent_notes[msg.channel].add(msg.note)
+            elif msg.type == "note_off":
+                self.sent_notes[msg.channel].discard(msg.note)
+
+    def redraw_velocities(
+        self, messages: list["mido.Message"]
+    ) -> list["mido.Message"]:
+        # The messages of an earlier step with their random velocities
+        # drawn again, in the order step_messages() draws them.
+        return [
+            (
+                msg.copy(velocity=self.random_velocity())
+                if msg.type == "note_off" or self.velocities is None
+                else msg
+            )
+            for msg in messages
+        ]
+
+    def random_velocity(self) -> int:
+        return int(self.rng.integers(20, 81))
+
+    def note_on_message(
+        self, channel: int, pitch: int, velocity: int | None = None
+    ) -> "mido.Message":
+        import mido
+
+        return mido.Message(
             "note_on",
             channel=channel,
             note=pitch,
-            velocity=randint(20, 80),
+            velocity=self.random_velocity() if velocity is None else velocity,
             time=0,
         )
-        self.midi_out.send(msg)
 
-    def play_note_off(self, channel: int, pitch: int) -> None:
-        msg = mido.Message(
+    def note_off_message(self, channel: int, pitch: int) -> "mido.Message":
+        import mido
+
+        return mido.Message(
             "note_off",
             channel=channel,
             note=pitch,
-            velocity=randint(20, 80),
+            velocity=self.random_velocity(),
             time=0,
         )
-        self.midi_out.send(msg)
+
+    def play_note_on(self, channel: int, pitch: int) -> None:
+        self.sounding_notes[channel].add(pitch)
+        self.send_messages([self.note_on_message(channel, pitch)])
+
+    def play_note_off(self, channel: int, pitch: int) -> None:
+        self.sounding_notes[channel].discard(pitch)
+        self.send_messages([self.note_off_message(channel, pitch)])
+
+    def release_all(self) -> None:
+        self.send_messages(
+            [
+                self.note_off_message(channel, pitch)
+                for channel, pitches in self.sent_notes.items()
+                for pitch in sorted(pitches)
+            ]
+        )
+        for pitches in self.sounding_notes.values():
+            pitches.clear()
+
+    def close(self) -> None:
+        if self.face_cells is not None:
+            self.liquiprism.unsubscribe(self.observe)
+            self.face_cells = None
+        self.release_all()
+        if self.owns_port and self.midi_out is not None:
+            self.midi_out.close()
@@ -0,0 +1,268 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from liquiprism import FacePosition, Liquiprism
+from rules import FaceRules
+from sonifier import VOICES, Sonifier
+
+STEPS = 600
+STEP_TIME = 1000
+# Columns holding one value per step, stored back to back for all points
+# and sliced with the offsets column.
+SERIES_COLUMNS = ("activity", "density")
+
+
+class NoteCounter:
+    # Stands in for a mido output and counts the note ons of each channel.
+    def __init__(self):
+        self.note_ons = np.zeros(len(FacePosition), dtype=np.int64)
+
+    def send(self, msg) -> None:
+        if msg.type == "note_on":
+            self.note_ons[msg.channel] += 1
+
+    def close(self) -> None:
+        pass
+
+
+def parse_update_rates(value: str) -> str | tuple[int]:
+    # "random", "fixed" or six comma separated rates, one per face.
+    if value in ("random", "fixed"):
+        return value
+    rates = tuple(int(rate) for rate in value.split(","))
+    if len(rates) != len(FacePosition) or min(rates) < 1:
+        raise argparse.ArgumentTypeError(
+            f"Expected 'random', 'fixed' or {len(FacePosition)} positive "
+            f"rates, got {value!r}"
+        )
+    return rates
+
+
+def expand_grid(grid: dict[str, list]) -> list[dict]:
+    # Every combination of the grid's values, in the grid's order.
+    names = list(grid)
+    return [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[name] for name in names))
+    ]
+
+
+def point_key(params: dict) -> str:
+    # The engines are equivalent under a seed, so the engine is left out.
+    params = {
+        name: value for name, value in params.items() if name != "engine"
+    }
+    encoded = json.dumps(params, sort_keys=True, default=list).encode()
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def run_point(params: dict) -> dict:
+    # Runs one seeded simulation headless and returns its metrics.
+    size = params["size"]
+    update_rates = params["update_rates"]
+    liquiprism = Liquiprism(
+        size,
+        random_update_rate=update_rates == "random",
+        engine=params.get("engine", "numpy"),
+        seed=params["seed"],
+    )
+    if isinstance(update_rates, (tuple, list)):
+        for face, update_rate in zip(liquiprism.faces, update_rates):
+            face.update_rate = update_rate
+    liquiprism.set_rules(FaceRules(stimulus=params["stimulus"]))
+    threshold = params["threshold"]
+    if threshold is not None:
+        liquiprism.CELL_STATE_CHANGE_THRESHOLD = threshold
+    threshold = liquiprism.CELL_STATE_CHANGE_THRESHOLD
+
+    counter = NoteCounter()
+    sonifier = Sonifier(liquiprism, midi_out=counter, voices=params["voices"])
+    steps = params["steps"]
+    activity = np.zeros(steps, dtype=np.int64)
+    density = np.zeros((steps, len(FacePosition)))
+    try:
+        for step in range(steps):
+            liquiprism.step()
+            sonifier.update()
+            activity[step] = liquiprism.activity
+            density[step] = liquiprism.get_alive_array().mean(axis=(1, 2))
+        update_rates = [face.update_rate for face in liquiprism.faces]
+    finally:
+        liquiprism.close()
+
+    # The conventional rule takes over from the threshold-th stimulated
+    # cell of a step, -1 when no step gets that far.
+    reached = np.flatnonzero(activity >= threshold)
+    return {
+        "key": point_key(params),
+        "size": size,
+        "update_rates": update_rates,
+        "stimulus": params["stimulus"],
+        "voices": params["voices"],
+        "threshold": threshold,
+        "seed": params["seed"],
+        "steps": steps,
+        "step_time": params["step_time"],
+        "note_rate": counter.note_ons / (steps * params["step_time"] / 1000),
+        "conventional_step": int(reached[0]) + 1 if len(reached) else -1,
+        "activity": activity,
+        "density": density,
+    }
+
+
+def load_results(path: str) -> dict[str, np.ndarray]:
+    if not os.path.exists(path):
+        return {}
+    with np.load(path) as columns:
+        return dict(columns)
+
+
+def series(results: dict[str, np.ndarray], column: str, row: int):
+    # The per step values of one point of a series column.
+    offsets = results["offsets"]
+    return results[column][offsets[row] : offsets[row + 1]]
+
+
+def to_columns(points: list[dict]) -> dict[str, np.ndarray]:
+    columns = {
+        name: np.array([point[name] for point in points])
+        for name in points[0]
+        if name not in SERIES_COLUMNS
+    }
+    for name in SERIES_COLUMNS:
+        columns[name] = np.concatenate([point[name] for point in points])
+    columns["offsets"] = np.cumsum(
+        [0] + [len(point["activity"]) for point in points]
+    )
+    return columns
+
+
+def append_results(path: str, points: list[dict]) -> dict[str, np.ndarray]:
+    # Adds the points to the columns already in path. The file is replaced
+    # in one move, so an interrupted write never loses earlier points.
+    results = load_results(path)
+    if not points:
+        return results
+    new = to_columns(points)
+    if results:
+        offsets = results["offsets"]
+        new["offsets"] = new["offsets"][1:] + offsets[-1]
+        new = {
+            name: np.concatenate([results[name], new[name]]) for name in new
+        }
+    temporary = f"{path}.tmp.npz"
+    np.savez(temporary, **new)
+    os.replace(temporary, path)
+    return new
+
+
+def run_sweep(
+    path: str,
+    grid: dict[str, list],
+    steps: int = STEPS,
+    step_time: int = STEP_TIME,
+    engine: str = "numpy",
+    workers: int | None = None,
+) -> dict[str, np.ndarray]:
+    # Runs every point of the grid not already in path across a process
+    # pool and appends their metrics to path.
+    done = set(load_results(path).get("key", []))
+    todo = {}
+    for params in expand_grid(grid):
+        params.update(steps=steps, step_time=step_time)
+        key = point_key(params)
+        if key not in done:
+            todo[key] = dict(params, engine=engine)
+
+    points = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_point, params) for params in todo.values()
+            ]
+            for future in as_completed(futures):
+                points.append(future.result())
+                print(
+                    f"{len(done) + len(points)}/{len(done) + len(todo)} "
+                    f"points",
+                    flush=True,
+                )
+    finally:
+        # Completed points are kept even if the sweep is interrupted.
+        results = append_results(path, points)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a grid of seeded simulations and cache the metrics."
+    )
+    parser.add_argument("path", help="output .npz file, also the cache")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[7])
+    parser.add_argument(
+        "--update-rates",
+        nargs="+",
+        type=parse_update_rates,
+        default=["random"],
+        help="'random', 'fixed' or six comma separated rates",
+    )
+    parser.add_argument(
+        "--stimulus",
+        nargs="+",
+        type=float,
+        default=[FaceRules.stimulus],
+        help="probability of a dead frontmost cell becoming alive",
+    )
+    parser.add_argument(
+        "--voices",
+        nargs="+",
+        type=int,
+        default=[VOICES],
+        help="notes sounding per face",
+    )
+    parser.add_argument(
+        "--thresholds",
+        nargs="+",
+        type=int,
+        default=[None],
+        help="stimulated cells per step before the conventional rule is used",
+    )
+    parser.add_argument("--seeds", nargs="+", type=int, default=[0])
+    parser.add_argument("--steps", type=int, default=STEPS)
+    parser.add_argument(
+        "--step-time",
+        type=int,
+        default=STEP_TIME,
+        help="milliseconds per step",
+    )
+    parser.add_argument(
+        "--engine", default="numpy", choices=Liquiprism.ENGINES
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    run_sweep(
+        args.path,
+        {
+            "size": args.sizes,
+            "update_rates": args.update_rates,
+            "stimulus": args.stimulus,
+            "voices": args.voices,
+            "threshold": args.thresholds,
+            "seed": args.seeds,
+        },
+        steps=args.steps,
+        step_time=args.step_time,
+        engine=args.engine,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import json
+from collections import deque
+
+import numpy as np
+
+from liquiprism import FacePosition, Liquiprism, StepRecord
+
+TELEMETRY_HISTORY = 1000  # step records kept
+QUANTILES = (0.5, 0.95, 0.99)
+FACE_NAMES = [face_position.name.lower() for face_position in FacePosition]
+
+
+def record_json(record: StepRecord) -> dict:
+    return {
+        "step": record.step_counter,
+        "wall_time": record.wall_time,
+        "activity": record.activity,
+        "updated": record.updated.tolist(),
+        "alive_counts": record.alive_counts.tolist(),
+        "stimulated": record.stimulated.tolist(),
+        "died": record.died.tolist(),
+    }
+
+
+class TelemetryBuffer:
+    # Subscribes to a prism and keeps its last step records, the totals
+    # cover every step seen since it subscribed.
+    def __init__(
+        self,
+        liquiprism: Liquiprism | None = None,
+        history: int = TELEMETRY_HISTORY,
+    ):
+        self.records = deque(maxlen=history)
+        self.steps = 0
+        self.stimulated = 0
+        self.died = 0
+        self.liquiprism = liquiprism
+        if liquiprism is not None:
+            liquiprism.subscribe(self)
+
+    def __repr__(self):
+        return f"TelemetryBuffer(steps={self.steps})"
+
+    def __len__(self):
+        return len(self.records)
+
+    def __call__(self, record: StepRecord) -> None:
+        self.records.append(record)
+        self.steps += 1
+        self.stimulated += len(record.stimulated)
+        self.died += len(record.died)
+
+    def close(self) -> None:
+        if self.liquiprism is not None:
+            self.liquiprism.unsubscribe(self)
+            self.liquiprism = None
+
+    def to_ndjson(self, path: str) -> None:
+        # One JSON object per buffered step, oldest first.
+        with open(path, "w") as ndjson_file:
+            for record in self.records:
+                ndjson_file.write(json.dumps(record_json(record)) + "\n")
+
+    def prometheus_lines(self) -> list[str]:
+        lines = [
+            "# HELP liquiprism_steps_total Steps computed.",
+            "# TYPE liquiprism_steps_total counter",
+            f"liquiprism_steps_total {self.steps}",
+            "# HELP liquiprism_stimulated_cells_total Cells born.",
+            "# TYPE liquiprism_stimulated_cells_total counter",
+            f"liquiprism_stimulated_cells_total {self.stimulated}",
+            "# HELP liquiprism_died_cells_total Cells that died.",
+            "# TYPE liquiprism_died_cells_total counter",
+            f"liquiprism_died_cells_total {self.died}",
+        ]
+        if not self.records:
+            return lines
+
+        last = self.records[-1]
+        lines += [
+            "# HELP liquiprism_activity Cells stimulated by the last step.",
+            "# TYPE liquiprism_activity gauge",
+            f"liquiprism_activity {last.activity}",
+            "# HELP liquiprism_alive_cells Alive cells per face.",
+            "# TYPE liquiprism_alive_cells gauge",
+        ]
+        lines += [
+            f'liquiprism_alive_cells{{face="{name}"}} {count}'
+            for name, count in zip(FACE_NAMES, last.alive_counts.tolist())
+        ]
+        lines += [
+            "# HELP liquiprism_face_updated Whether the face was updated.",
+            "# TYPE liquiprism_face_updated gauge",
+        ]
+        lines += [
+            f'liquiprism_face_updated{{face="{name}"}} {int(updated)}'
+            for name, updated in zip(FACE_NAMES, last.updated.tolist())
+        ]
+
+        wall_times = np.array([record.wall_time for record in self.records])
+        lines += [
+            "# HELP liquiprism_step_seconds Wall time of the buffered steps.",
+            "# TYPE liquiprism_step_seconds summary",
+        ]
+        lines += [
+            f'liquiprism_step_seconds{{quantile="{quantile}"}} {value:.9f}'
+            for quantile, value in zip(
+                QUANTILES, np.quantile(wall_times, QUANTILES)
+            )
+        ]
+        lines += [
+            f"liquiprism_step_seconds_sum {wall_times.sum():.9f}",
+            f"liquiprism_step_seconds_count {len(wall_times)}",
+        ]
+        return lines
+
+    def to_prometheus(self, path: str) -> None:
+        # Text exposition format, e.g. for node_exporter's textfile
+        # collector.
+        with open(path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(self.prometheus_lines()) + "\n")
@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+
+from liquiprism import ArrayState, Face, FacePosition, FaceView, Liquiprism
+
+MAGIC = b"LQTRAJ01"
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S8"),
+        ("size", "<u4"),
+        ("update_rates", "u1", (len(FacePosition),)),
+        ("reserved", "V46"),
+    ]
+)  # 64 bytes
+
+
+def packed_bytes(size: int) -> int:
+    return (len(FacePosition) * size**2 + 7) // 8
+
+
+def frame_dtype(size: int) -> np.dtype:
+    # Every frame has the same stride, so frame k starts at
+    # HEADER_DTYPE.itemsize + k * stride and can be read by a memmap.
+    return np.dtype(
+        [
+            ("step_counter", "<i8"),
+            ("activity", "<i8"),
+            ("frontmost", "u1"),
+            ("alive", "u1", (packed_bytes(size),)),
+            ("stimulated", "u1", (packed_bytes(size),)),
+        ]
+    )
+
+
+def unpack_cells(packed: np.ndarray, size: int) -> np.ndarray:
+    return (
+        np.unpackbits(packed, count=len(FacePosition) * size**2)
+        .astype(bool)
+        .reshape(len(FacePosition), size, size)
+    )
+
+
+class TrajectoryRecorder:
+    def __init__(self, path: str, liquiprism: Liquiprism):
+        self.path = path
+        self.liquiprism = liquiprism
+        self.size = liquiprism.size
+        self.frame = np.zeros(1, dtype=frame_dtype(self.size))
+
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["size"] = self.size
+        header["update_rates"] = [
+            face.update_rate for face in liquiprism.faces
+        ]
+        self.file = open(path, "wb")
+        self.file.write(header.tobytes())
+        # Frame 0 is the initial state, frame k the state after step k.
+        self.record()
+
+    def __repr__(self):
+        return f"TrajectoryRecorder(path={self.path!r})"
+
+    def record(self) -> None:
+        frame = self.frame[0]
+        frame["step_counter"] = self.liquiprism.step_counter
+        frame["activity"] = self.liquiprism.activity
+        frame["frontmost"] = self.liquiprism.frontmost_face.position.value
+        frame["alive"] = np.packbits(self.liquiprism.get_alive_array())
+        frame["stimulated"] = np.packbits(
+            self.liquiprism.get_stimulated_array()
+        )
+        self.file.write(self.frame.tobytes())
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class TrajectoryReplay:
+    def __init__(self, path: str):
+        self.path = path
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+        if len(header) == 0 or header["magic"][0] != MAGIC:
+            raise ValueError(f"{path!r} is not a Liquiprism trajectory")
+
+        self.size = int(header["size"][0])
+        self.frame_dtype = frame_dtype(self.size)
+        self.state = ArrayState(
+            alive=np.zeros((len(FacePosition), self.size, self.size), bool),
+            update_rates=header["update_rates"][0].astype(int),
+            stimulated=np.zeros(
+                (len(FacePosition), self.size, self.size), bool
+            ),
+        )
+        self.faces = [
+            FaceView(state=self.state, position=position, size=self.size)
+            for position in list(FacePosition)
+        ]
+        self.frames = None
+        self.refresh()
+        self.seek(0)
+
+    def __repr__(self):
+        return f"TrajectoryReplay(path={self.path!r}, frames={len(self)})"
+
+    def __len__(self):
+        return len(self.frames)
+
+    def refresh(self) -> None:
+        # Maps every complete frame in the file, call again to pick up the
+        # frames a recorder has appended since.
+        n_frames = (
+            os.path.getsize(self.path) - HEADER_DTYPE.itemsize
+        ) // self.frame_dtype.itemsize
+        self.frames = np.memmap(
+            self.path,
+            dtype=self.frame_dtype,
+            mode="r",
+            offset=HEADER_DTYPE.itemsize,
+            shape=(n_frames,),
+        )
+
+    def seek(self, index: int) -> None:
+        if not -len(self) <= index < len(self):
+            raise IndexError(f"frame {index} out of range")
+
+        self.index = index % len(self)
+        frame = self.frames[self.index]
+        self.step_counter = int(frame["step_counter"])
+        self.activity = int(frame["activity"])
+        self.recorded_frontmost = int(frame["frontmost"])
+        self.state.alive[:] = unpack_cells(frame["alive"], self.size)
+        self.state.stimulated[:] = unpack_cells(frame["stimulated"], self.size)
+
+    def step(self) -> None:
+        # Plays the next recorded step, holding the last one at the end.
+        if self.index + 1 < len(self):
+            self.seek(self.index + 1)
+
+    @property
+    def frontmost_face(self) -> FaceView:
+        return self.faces[self.recorded_frontmost]
+
+    @frontmost_face.setter
+    def frontmost_face(self, face: Face) -> None:
+        # The recorded steps already depend on the frontmost face they were
+        # computed with, so the visualizer's choice has no effect here.
+        pass
+
+    def get_face(self, face_position: FacePosition) -> FaceView:
+        return self.faces[face_position.value]
+
+    def get_alive_array(self) -> np.ndarray:
+        return self.state.alive.copy()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        return self.state.stimulated.copy()
+
+    def close(self) -> None:
+        self.frames = None
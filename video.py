@@ -0,0 +1,174 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+from collections.abc import Callable
+
+# pygame greets on stdout when imported, which would corrupt raw video
+# written there.
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import pygame
+
+from liquiprism import Liquiprism, PrismFrame
+from visualizer import HEIGHT, WIDTH, Visualizer
+
+FPS = 30
+FRAMES_PER_STEP = 30  # one step a second at FPS, as in main.py
+LOOKAHEAD_FRAMES = 8  # frames computed ahead of the one being drawn
+ROTATION_SPEED = 0.01  # radians per frame around the vertical axis
+
+
+def orbit(
+    speed_x: float = 0.0,
+    speed_y: float = ROTATION_SPEED,
+    speed_z: float = 0.0,
+) -> Callable[[int], tuple[float]]:
+    # Camera angles of each frame, turning at constant speeds.
+    return lambda frame: (speed_x * frame, speed_y * frame, speed_z * frame)
+
+
+class RawVideoWriter:
+    # Raw rgb24 frames back to back, e.g. for ffmpeg's rawvideo input.
+    def __init__(self, path: str):
+        self.path = path
+        self.stream = sys.stdout.buffer if path == "-" else open(path, "wb")
+
+    def __repr__(self):
+        return f"RawVideoWriter({self.path!r})"
+
+    def write(self, surface: pygame.Surface, frame: int) -> None:
+        self.stream.write(pygame.image.tobytes(surface, "RGB"))
+
+    def close(self) -> None:
+        if self.stream is sys.stdout.buffer:
+            self.stream.flush()
+        else:
+            self.stream.close()
+
+
+class ImageSequenceWriter:
+    # One image per frame, named by formatting the pattern with the frame
+    # number, e.g. "frames/%05d.png".
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+
+    def __repr__(self):
+        return f"ImageSequenceWriter({self.pattern!r})"
+
+    def write(self, surface: pygame.Surface, frame: int) -> None:
+        pygame.image.save(surface, self.pattern % frame)
+
+    def close(self) -> None:
+        pass
+
+
+def open_writer(path: str) -> RawVideoWriter | ImageSequenceWriter:
+    return ImageSequenceWriter(path) if "%" in path else RawVideoWriter(path)
+
+
+def render_video(
+    writer: RawVideoWriter | ImageSequenceWriter,
+    liquiprism: Liquiprism,
+    frames: int,
+    camera: Callable[[int], tuple[float]] = orbit(),
+    frames_per_step: int = FRAMES_PER_STEP,
+    lookahead: int = LOOKAHEAD_FRAMES,
+) -> None:
+    # Steps the prism and moves the camera on this thread while another
+    # thread draws and writes the frames to an offscreen surface.
+    visualizer = Visualizer(liquiprism, screen=pygame.Surface((WIDTH, HEIGHT)))
+    pending = queue.Queue(maxsize=lookahead)
+    errors = []
+
+    def draw() -> None:
+        try:
+            while (item := pending.get()) is not None:
+                frame, angles, prism_frame = item
+                visualizer.angle_x, visualizer.angle_y, visualizer.angle_z = (
+                    angles
+                )
+                visualizer.liquiprism = prism_frame
+                visualizer.render()
+                writer.write(visualizer.screen, frame)
+        except Exception as error:
+            errors.append(error)
+            # Keeps the producer from blocking on a full queue.
+            while pending.get() is not None:
+                pass
+
+    thread = threading.Thread(target=draw, daemon=True)
+    thread.start()
+    try:
+        for frame in range(frames):
+            if frame and frame % frames_per_step == 0:
+                liquiprism.step()
+            angles = camera(frame)
+            pending.put((frame, angles, PrismFrame(liquiprism)))
+            # The face facing the camera is the frontmost one, as when
+            # rendering live, so the next step depends on the camera.
+            liquiprism.frontmost_face = liquiprism.get_face(
+                visualizer.front_face(*angles)
+            )
+            if errors:
+                break
+    finally:
+        pending.put(None)
+        thread.join()
+        writer.close()
+    if errors:
+        raise errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Render the rotating prism to video without a display."
+    )
+    parser.add_argument(
+        "path",
+        help="raw rgb24 output file, '-' for stdout, or an image pattern "
+        "such as frames/%%05d.png",
+    )
+    parser.add_argument("--frames", type=int, default=10 * FPS)
+    parser.add_argument("--size", type=int, default=7)
+    parser.add_argument(
+        "--engine", default="numpy", choices=Liquiprism.ENGINES
+    )
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument(
+        "--fixed-update-rate",
+        action="store_true",
+        help="update every face on every step",
+    )
+    parser.add_argument("--frames-per-step", type=int, default=FRAMES_PER_STEP)
+    parser.add_argument(
+        "--rotate",
+        nargs=3,
+        type=float,
+        default=(0.0, ROTATION_SPEED, 0.0),
+        metavar=("X", "Y", "Z"),
+        help="radians per frame around each axis",
+    )
+    args = parser.parse_args()
+
+    liquiprism = Liquiprism(
+        size=args.size,
+        random_update_rate=not args.fixed_update_rate,
+        engine=args.engine,
+        seed=args.seed,
+    )
+    try:
+        render_video(
+            open_writer(args.path),
+            liquiprism,
+            args.frames,
+            camera=orbit(*args.rotate),
+            frames_per_step=args.frames_per_step,
+        )
+    finally:
+        liquiprism.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,15 @@
 import math
 
+import numpy as np
 import pygame
 
-from liquiprism import Face, FacePosition, Liquiprism
-
-pygame.init()
+from liquiprism import FacePosition, Liquiprism
+from profiler import FrameProfiler
 
 WIDTH, HEIGHT = 800, 800
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
+TEXT_CACHE_SIZE = 256
 
 
 class Visualizer:
@@ -30,14 +31,33 @@ class Visualizer:
         FacePosition.BOTTOM: (0, 1, 5, 4),
     }
 
-    def __init__(self, liquiprism: Liquiprism):
+    def __init__(
+        self,
+        liquiprism: Liquiprism,
+        profiler: FrameProfiler | None = None,
+        screen: pygame.Surface | None = None,
+    ):
         self.liquiprism = liquiprism
+        self.profiler = profiler
         self.angle_x = 0
         self.angle_y = 0
         self.angle_z = 0
         self.scale = 150
         self.clock = pygame.time.Clock()
-        self.screen = pygame.display.set_mode((WIDTH, HEIGHT))
+        if screen is None:
+            # Only the display is initialized, when a visualizer is created,
+            # so importing this module starts no audio or video subsystem.
+            pygame.display.init()
+            screen = pygame.display.set_mode((WIDTH, HEIGHT))
+        # Any surface can be drawn to instead of the window, which needs no
+        # display at all.
+        self.screen = screen
+        self.cube_surface = pygame.Surface((WIDTH, HEIGHT))
+        self.font = None
+        self.text_cache = {}
+        self.geometry_key = None
+        self.face_grids = {}
+        self.drawn_alive = None
 
         self.vertices = [
             [-1, -1, -1],
@@ -80,77 +100,11 @@ class Visualizer:
         y_proj = -y * self.scale + HEIGHT // 2
         return int(x_proj), int(y_proj)
 
-    def interpolate(self, v0, v1, v3, v2, t1, t2):
-        x0, y0 = self.interpolate_linear(v0, v1, t2)
-        x1, y1 = self.interpolate_linear(v3, v2, t2)
-        return self.interpolate_linear((x0, y0), (x1, y1), t1)
-
-    def interpolate_linear(self, v0, v1, t):
-        x0, y0 = v0
-        x1, y1 = v1
-        return (x0 * (1 - t) + x1 * t, y0 * (1 - t) + y1 * t)
-
     def calculate_face_depth(self, face_vertices, vertices):
         return sum(vertices[idx][2] for idx in face_vertices) / len(
             face_vertices
         )
 
-    def draw_face(
-        self, face_vertices: list[int], liquiprism_face: Face, vertices, tint
-    ):
-        points = [vertices[idx] for idx in face_vertices]
-        for i in range(self.liquiprism.size):
-            for j in range(self.liquiprism.size):
-                top_left = self.interpolate(
-                    points[0],
-                    points[1],
-                    points[3],
-                    points[2],
-                    i / self.liquiprism.size,
-                    j / self.liquiprism.size,
-                )
-                top_right = self.interpolate(
-                    points[0],
-                    points[1],
-                    points[3],
-                    points[2],
-                    i / self.liquiprism.size,
-                    (j + 1) / self.liquiprism.size,
-                )
-                bottom_left = self.interpolate(
-                    points[0],
-                    points[1],
-                    points[3],
-                    points[2],
-                    (i + 1) / self.liquiprism.size,
-                    j / self.liquiprism.size,
-                )
-                bottom_right = self.interpolate(
-                    points[0],
-                    points[1],
-                    points[3],
-                    points[2],
-                    (i + 1) / self.liquiprism.size,
-                    (j + 1) / self.liquiprism.size,
-                )
-
-                cell = liquiprism_face.get_cell((i, j))
-                color = WHITE if cell.is_alive else BLACK
-                blended_color = self.blend_color(tint, color)
-
-                pygame.draw.polygon(
-                    self.screen,
-                    blended_color,
-                    [top_left, top_right, bottom_right, bottom_left],
-                )
-                pygame.draw.lines(
-                    self.screen,
-                    WHITE,
-                    True,
-                    [top_left, top_right, bottom_right, bottom_left],
-                    1,
-                )
-
     def blend_color(self, base_color, grid_color, blend_factor=0.5):
         return tuple(
             int(
@@ -160,13 +114,22 @@ class Visualizer:
             for i in range(3)
         )
 
+    def render_text(self, text: str) -> pygame.Surface:
+        if self.font is None:
+            pygame.font.init()
+            self.font = pygame.font.SysFont("Courier New", 12)
+        if text not in self.text_cache:
+            if len(self.text_cache) >= TEXT_CACHE_SIZE:
+                self.text_cache.clear()
+            self.text_cache[text] = self.font.render(text, False, WHITE)
+        return self.text_cache[text]
+
     def draw_legend(self):
-        font = pygame.font.SysFont("Courier New", 12)
         legend_x = 10
         legend_y = 10
         square_size = 12
 
-        text = font.render("face position  update rate", False, WHITE)
+        text = self.render_text("face position  update rate")
         self.screen.blit(text, (legend_x + square_size + 5, legend_y))
         legend_y += square_size + 10
 
@@ -178,67 +141,154 @@ class Visualizer:
             )
 
             face = self.liquiprism.get_face(face_position)
-            text = font.render(
-                f"{face_position.name.lower():<15}{face.update_rate}",
-                False,
-                WHITE,
+            text = self.render_text(
+                f"{face_position.name.lower():<15}{face.update_rate}"
             )
             self.screen.blit(text, (legend_x + square_size + 5, legend_y))
 
             legend_y += square_size + 10
 
     def draw_steps(self):
-        font = pygame.font.SysFont("Courier New", 12)
-        text = font.render(
-            f"Step: {self.liquiprism.step_counter}", False, WHITE
-        )
+        text = self.render_text(f"Step: {self.liquiprism.step_counter}")
         _, steps_y = self.screen.get_size()
         self.screen.blit(text, (10, steps_y - 20))
 
     def draw_cells_state_change(self):
-        font = pygame.font.SysFont("Courier New", 12)
-        text = font.render(
-            f"Stimulated cells: {self.liquiprism.activity}",
-            False,
-            WHITE,
+        text = self.render_text(
+            f"Stimulated cells: {self.liquiprism.activity}"
         )
         _, steps_y = self.screen.get_size()
         self.screen.blit(text, (10, steps_y - 40))
 
-    def render(self):
-        self.draw_legend()
-        self.draw_steps()
-        self.draw_cells_state_change()
-
-        rotated_vertices = [
+    def draw_profile(self):
+        _, profile_y = self.screen.get_size()
+        profile_y -= 60
+        for line in reversed(self.profiler.summary()):
+            self.screen.blit(self.render_text(line), (10, profile_y))
+            profile_y -= 20
+
+    def face_grid(self, points) -> np.ndarray:
+        # Bilinear interpolation of every grid corner of a face at once,
+        # grid[a, b] is the corner at t1 = a / size and t2 = b / size, so
+        # cell (i, j) spans grid[i:i + 2, j:j + 2].
+        p0, p1, p2, p3 = np.array(points, dtype=float)
+        t = np.linspace(0, 1, self.liquiprism.size + 1)[:, None]
+        top = p0 * (1 - t) + p1 * t
+        bottom = p3 * (1 - t) + p2 * t
+        t1 = t[:, :, None]
+        return top[None] * (1 - t1) + bottom[None] * t1
+
+    def rotate_vertices(
+        self, angle_x: float, angle_y: float, angle_z: float
+    ) -> list[tuple]:
+        return [
             self.rotate_x(
-                self.rotate_y(
-                    self.rotate_z(vertex, self.angle_z), self.angle_y
-                ),
-                self.angle_x,
+                self.rotate_y(self.rotate_z(vertex, angle_z), angle_y),
+                angle_x,
             )
             for vertex in self.vertices
         ]
 
-        transformed_vertices = [self.project(v) for v in rotated_vertices]
+    def sort_faces(self, rotated_vertices: list[tuple]) -> list[FacePosition]:
+        # From the farthest face to the nearest one.
+        return [
+            face_position
+            for face_position, _ in sorted(
+                self.FACE_VERTICES.items(),
+                key=lambda item: self.calculate_face_depth(
+                    item[1], rotated_vertices
+                ),
+                reverse=True,
+            )
+        ]
 
-        sorted_faces = sorted(
-            self.FACE_VERTICES.items(),
-            key=lambda item: self.calculate_face_depth(
-                item[1], rotated_vertices
-            ),
-            reverse=True,
+    def front_face(
+        self, angle_x: float, angle_y: float, angle_z: float
+    ) -> FacePosition:
+        # The face render() makes frontmost for these angles, without
+        # touching the cached geometry.
+        return self.sort_faces(
+            self.rotate_vertices(angle_x, angle_y, angle_z)
+        )[-1]
+
+    def update_geometry(self) -> list[FacePosition]:
+        # Returns the faces in drawing order, rebuilding the cell grids of
+        # the visible faces only when the camera or the size changed.
+        key = (
+            self.angle_x,
+            self.angle_y,
+            self.angle_z,
+            self.scale,
+            self.liquiprism.size,
         )
+        if key == self.geometry_key:
+            return self.sorted_faces
 
-        for face_position, face_vertices in sorted_faces:
-            liquiprism_face = self.liquiprism.get_face(face_position)
-            self.draw_face(
-                face_vertices,
-                liquiprism_face,
-                transformed_vertices,
-                self.FACE_TINTS[face_position],
-            )
+        rotated_vertices = self.rotate_vertices(
+            self.angle_x, self.angle_y, self.angle_z
+        )
+        transformed_vertices = [self.project(v) for v in rotated_vertices]
+        self.sorted_faces = self.sort_faces(rotated_vertices)
+        # The cube is convex and opaque, so only faces turned towards the
+        # viewer can be seen and they never overlap each other.
+        self.face_grids = {
+            face_position: self.face_grid(
+                [transformed_vertices[idx] for idx in face_vertices]
+            ).tolist()
+            for face_position, face_vertices in self.FACE_VERTICES.items()
+            if self.calculate_face_depth(face_vertices, rotated_vertices) < 0
+        }
+        self.geometry_key = key
+        self.drawn_alive = None
+        return self.sorted_faces
+
+    def draw_cell(self, grid, tint, i: int, j: int, is_alive: bool) -> None:
+        quad = [grid[i][j], grid[i][j + 1], grid[i + 1][j + 1], grid[i + 1][j]]
+        pygame.draw.polygon(
+            self.cube_surface,
+            self.blend_color(tint, WHITE if is_alive else BLACK),
+            quad,
+        )
+
+    def draw_grid_lines(self, grid) -> None:
+        # One line per grid row and column instead of an outline per cell.
+        for a in range(len(grid)):
+            pygame.draw.line(self.cube_surface, WHITE, grid[a][0], grid[a][-1])
+            pygame.draw.line(self.cube_surface, WHITE, grid[0][a], grid[-1][a])
+
+    def draw_cube(self) -> None:
+        # Only cells that changed since the last frame are repainted, the
+        # rest of the cube is kept on its own surface.
+        alive = self.liquiprism.get_alive_array()
+        if self.drawn_alive is None or self.drawn_alive.shape != alive.shape:
+            self.cube_surface.fill(BLACK)
+            changed = np.ones(alive.shape, dtype=bool)
+        else:
+            changed = alive != self.drawn_alive
+
+        for face_position, grid in self.face_grids.items():
+            face_changed = changed[face_position.value]
+            if not face_changed.any():
+                continue
+            tint = self.FACE_TINTS[face_position]
+            face_alive = alive[face_position.value]
+            for i, j in zip(*np.nonzero(face_changed)):
+                self.draw_cell(grid, tint, i, j, face_alive[i, j])
+            self.draw_grid_lines(grid)
+
+        self.drawn_alive = alive
+        self.screen.blit(self.cube_surface, (0, 0))
+
+    def render(self):
+        sorted_faces = self.update_geometry()
+        self.draw_cube()
+
+        self.draw_legend()
+        self.draw_steps()
+        self.draw_cells_state_change()
+        if self.profiler is not None and self.profiler.enabled:
+            self.draw_profile()
 
         self.liquiprism.frontmost_face = self.liquiprism.get_face(
-            face_position
+            sorted_faces[-1]
         )
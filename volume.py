@@ -0,0 +1,367 @@
+from functools import cached_property, lru_cache
+
+import numpy as np
+
+from liquiprism import FacePosition, FaceView
+from rng import PrismRNG
+from rules import (
+    CONVENTIONAL,
+    LEGACY_RULES,
+    MAX_NEIGHBORS,
+    STIMULUS,
+    STOCHASTIC,
+    FaceRules,
+    compile_face_rules,
+)
+
+VOLUME_NEIGHBORS = 26
+# A voxel's rule input is coded as alive * 54 + alive_neighbors * 2 + below.
+VOLUME_CODES = 2 * (VOLUME_NEIGHBORS + 1) * 2
+
+
+def compile_volume_rules(rules: FaceRules | None = None) -> np.ndarray:
+    # (3, VOLUME_CODES) probabilities of being alive after an update. The
+    # face rules count neighbors out of 8, a voxel's count out of 26 is
+    # scaled to the nearest of those.
+    face_table = compile_face_rules(rules or LEGACY_RULES)
+    scaled = np.rint(
+        np.arange(VOLUME_NEIGHBORS + 1) * MAX_NEIGHBORS / VOLUME_NEIGHBORS
+    ).astype(int)
+    table = (
+        face_table[:, :, scaled, :]
+        .reshape(len(face_table), VOLUME_CODES)
+        .astype(np.float32)
+    )
+    table.flags.writeable = False
+    return table
+
+
+LEGACY_VOLUME_TABLE = compile_volume_rules()
+
+
+class VolumeTopology:
+    def __init__(self, size: int):
+        self.size = size
+        self.n_voxels = size**3
+        self.n_shells = (size + 1) // 2
+
+    @cached_property
+    def depths(self) -> np.ndarray:
+        # (size, size, size) shell of each voxel, 0 for the outer one.
+        edge = np.arange(self.size)
+        edge = np.minimum(edge, edge[::-1]).astype(np.uint8)
+        depths = np.minimum(
+            np.minimum(edge[:, None, None], edge[None, :, None]),
+            edge[None, None, :],
+        )
+        depths.flags.writeable = False
+        return depths
+
+    @lru_cache(maxsize=None)
+    def surface(self, depth: int) -> np.ndarray:
+        # (6, m, m) flat voxel indices of the faces of a shell, m being its
+        # size. Axes are (front to back, top to bottom, left to right) and
+        # faces are laid out so their seams meet as in FACE_MAP.
+        first, last = depth, self.size - 1 - depth
+        edge = np.arange(first, last + 1)
+        i, j = np.meshgrid(edge, edge, indexing="ij")
+        reversed_i, reversed_j = last + first - i, last + first - j
+        first, last = np.full_like(i, first), np.full_like(i, last)
+        voxels = {
+            FacePosition.FRONT: (first, i, j),
+            FacePosition.BACK: (last, i, reversed_j),
+            FacePosition.LEFT: (reversed_j, i, first),
+            FacePosition.RIGHT: (j, i, last),
+            FacePosition.TOP: (reversed_i, first, j),
+            FacePosition.BOTTOM: (i, last, j),
+        }
+        surface = np.stack(
+            [
+                np.ravel_multi_index(voxels[position], (self.size,) * 3)
+                for position in FacePosition
+            ]
+        )
+        surface.flags.writeable = False
+        return surface
+
+
+@lru_cache(maxsize=16)
+def get_volume_topology(size: int) -> VolumeTopology:
+    return VolumeTopology(size)
+
+
+def box_sum(values: np.ndarray, axis: int) -> np.ndarray:
+    # Sums of 3 consecutive values along axis, 2 shorter than values.
+    length = values.shape[axis] - 2
+    index = [slice(None)] * values.ndim
+    parts = []
+    for offset in range(3):
+        index[axis] = slice(offset, offset + length)
+        parts.append(values[tuple(index)])
+    total = np.add(parts[0], parts[1])
+    total += parts[2]
+    return total
+
+
+def count_volume_neighbors(alive: np.ndarray) -> np.ndarray:
+    # Alive neighbors of every voxel as a separable 3x3x3 box sum less the
+    # voxel itself, voxels past the outer shell count as dead.
+    sums = np.pad(alive.view(np.uint8), 1)
+    for axis in range(alive.ndim):
+        sums = box_sum(sums, axis)
+    sums -= alive
+    return sums
+
+
+def volume_codes(alive, alive_neighbors, bellow_alive) -> np.ndarray:
+    codes = alive.astype(np.uint8) * np.uint8(VOLUME_CODES // 2)
+    codes += alive_neighbors * np.uint8(2)
+    codes += bellow_alive
+    return codes
+
+
+def evolve_volume(
+    alive: np.ndarray,
+    stimulated: np.ndarray,
+    topology: VolumeTopology,
+    due: np.ndarray,
+    frontmost: int,
+    threshold: int,
+    uniforms: np.ndarray,
+    rule_table: np.ndarray = LEGACY_VOLUME_TABLE,
+) -> int:
+    # alive/stimulated/uniforms are (size, size, size) and due is (n_shells,).
+    # Updates the due shells in place and returns the activity. The voxels
+    # of the frontmost face of the outer shell follow the stimulus rule.
+    bellow_alive = np.zeros_like(alive)
+    bellow_alive[:, :-1] = alive[:, 1:]
+    codes = volume_codes(
+        alive, count_volume_neighbors(alive), bellow_alive
+    ).ravel()
+    front = topology.surface(0)[frontmost].ravel()
+
+    def draw(regime: int, start: int = 0) -> np.ndarray:
+        # Outcomes of the voxels from start on in visiting order.
+        probabilities = rule_table[regime].take(codes[start:])
+        front_after = front[front >= start]
+        probabilities[front_after - start] = rule_table[STIMULUS].take(
+            codes[front_after]
+        )
+        return uniforms.ravel()[start:] < probabilities
+
+    will_be_alive = draw(STOCHASTIC if threshold > 0 else CONVENTIONAL)
+    # None when every shell is due, sparing masks over the whole volume.
+    due = None if due.all() else due[topology.depths].ravel()
+
+    def stimulates(will_be_alive: np.ndarray) -> np.ndarray:
+        will_stimulate = will_be_alive & ~alive.ravel()
+        if due is not None:
+            will_stimulate &= due
+        return will_stimulate
+
+    will_stimulate = stimulates(will_be_alive)
+
+    # Voxels are visited in row-major order, and every voxel after the
+    # activity counter reaches the threshold follows the conventional rule.
+    if 0 < threshold <= np.count_nonzero(will_stimulate):
+        start = np.flatnonzero(will_stimulate)[threshold - 1] + 1
+        will_be_alive[start:] = draw(CONVENTIONAL, start)
+        will_stimulate = stimulates(will_be_alive)
+
+    updated = True if due is None else due
+    np.copyto(stimulated.ravel(), will_stimulate, where=updated)
+    np.copyto(alive.ravel(), will_be_alive, where=updated)
+    return int(np.count_nonzero(will_stimulate))
+
+
+class ShellCells:
+    # One voxel array of the volume indexed like a (6, m, m) face array of
+    # a shell, reading and writing the volume's voxels directly.
+    def __init__(self, volume: "VolumePrism", name: str, surface: np.ndarray):
+        self.volume = volume
+        self.name = name
+        self.surface = surface
+        self.shape = surface.shape
+
+    def __repr__(self):
+        return f"ShellCells({self.name!r}, shape={self.shape})"
+
+    def __getitem__(self, key) -> np.ndarray | np.bool_:
+        return getattr(self.volume, self.name).ravel()[self.surface[key]]
+
+    def __setitem__(self, key, value) -> None:
+        getattr(self.volume, self.name).ravel()[self.surface[key]] = value
+
+    def copy(self) -> np.ndarray:
+        return self[...]
+
+
+class ShellState:
+    # The faces of one shell, as FaceView expects them from an ArrayState.
+    # A cell is looked up in the volume on its own, so reading one does
+    # not gather the whole shell.
+    def __init__(self, volume: "VolumePrism", depth: int):
+        self.volume = volume
+        self.depth = depth
+        self.surface = volume.topology.surface(depth)
+        self.alive = ShellCells(volume, "alive", self.surface)
+        self.stimulated = ShellCells(volume, "stimulated", self.surface)
+
+    @property
+    def update_rates(self) -> np.ndarray:
+        # Read-only, the rate belongs to the shell and not to a face.
+        update_rates = np.full(
+            len(FacePosition), self.volume.update_rates[self.depth]
+        )
+        update_rates.flags.writeable = False
+        return update_rates
+
+
+class Shell:
+    # One shell of a VolumePrism behind the surface interface of a
+    # Liquiprism, so a Visualizer or a Sonifier can consume it.
+    def __init__(self, volume: "VolumePrism", depth: int):
+        self.volume = volume
+        self.depth = depth
+        self.size = volume.size - 2 * depth
+        self.state = ShellState(volume, depth)
+        self.faces = [
+            FaceView(state=self.state, position=position, size=self.size)
+            for position in list(FacePosition)
+        ]
+
+    def __repr__(self):
+        return f"Shell(depth={self.depth}, size={self.size})"
+
+    @property
+    def step_counter(self) -> int:
+        return self.volume.step_counter
+
+    @property
+    def activity(self) -> int:
+        return int(self.volume.shell_activity()[self.depth])
+
+    @property
+    def frontmost_face(self) -> FaceView:
+        return self.faces[self.volume.frontmost_face.index]
+
+    @frontmost_face.setter
+    def frontmost_face(self, face: FaceView) -> None:
+        # The stimulus is always applied to the outer shell.
+        self.volume.frontmost_face = self.volume.faces[face.index]
+
+    def get_face(self, face_position: FacePosition) -> FaceView:
+        return self.faces[face_position.value]
+
+    def get_alive_array(self) -> np.ndarray:
+        return self.state.alive.copy()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        return self.state.stimulated.copy()
+
+
+class VolumePrism:
+    # A solid cube of voxels with 26 neighbors each, made of nested shells
+    # that each have their own update rate. Its surface methods are those
+    # of the outer shell.
+    ACTIVITY_MODES = ("sequential", "previous")
+
+    def __init__(
+        self,
+        size: int,
+        random_update_rate: bool = False,
+        seed: int | np.random.SeedSequence | None = None,
+        activity_mode: str = "sequential",
+    ):
+        if activity_mode not in self.ACTIVITY_MODES:
+            raise ValueError(
+                f"Unknown activity mode {activity_mode!r}, expected one of "
+                f"{self.ACTIVITY_MODES}"
+            )
+
+        self.size = size
+        self.activity_mode = activity_mode
+        self.topology = get_volume_topology(size)
+        # The whole volume draws from a single stream.
+        self.rng = PrismRNG(seed, streams=1)
+        self.update_rates = self.rng.update_rates(
+            random_update_rate, self.topology.n_shells
+        )
+        self.uniforms = np.empty((size,) * 3, dtype=np.float32)
+        self.alive = self.draw_uniforms() < 0.5
+        self.stimulated = np.zeros_like(self.alive)
+        self.shells = [
+            Shell(self, depth) for depth in range(self.topology.n_shells)
+        ]
+        self.faces = self.shells[0].faces
+        self.activity = 0
+        # The same share of the cells as size**2 is of a Liquiprism's.
+        self.CELL_STATE_CHANGE_THRESHOLD = self.topology.n_voxels // len(
+            FacePosition
+        )
+        self.step_counter = 0
+        self.frontmost_face = self.faces[0]
+        self.set_rules(None)
+
+    def __repr__(self):
+        return f"VolumePrism(size={self.size}, step={self.step_counter})"
+
+    def draw_uniforms(self) -> np.ndarray:
+        return self.rng.faces[0].random(dtype=np.float32, out=self.uniforms)
+
+    def set_rules(self, rules: FaceRules | None) -> None:
+        self.rules = rules
+        self.rule_table = (
+            compile_volume_rules(rules)
+            if rules is not None
+            else LEGACY_VOLUME_TABLE
+        )
+
+    def get_face(self, face_position: FacePosition) -> FaceView:
+        return self.faces[face_position.value]
+
+    def get_alive_array(self) -> np.ndarray:
+        return self.shells[0].get_alive_array()
+
+    def get_stimulated_array(self) -> np.ndarray:
+        return self.shells[0].get_stimulated_array()
+
+    def get_volume(self) -> np.ndarray:
+        return self.alive.copy()
+
+    def shell_activity(self) -> np.ndarray:
+        # Stimulated voxels per shell, the ones of shells that were not due
+        # in the last step are left from an earlier one.
+        return np.bincount(
+            self.topology.depths.ravel()[np.flatnonzero(self.stimulated)],
+            minlength=self.topology.n_shells,
+        )
+
+    def close(self) -> None:
+        pass
+
+    def step_threshold(self) -> int:
+        # As Liquiprism.step_threshold.
+        if self.activity_mode == "sequential":
+            return self.CELL_STATE_CHANGE_THRESHOLD
+        if self.activity >= self.CELL_STATE_CHANGE_THRESHOLD:
+            return 0
+        return self.topology.n_voxels + 1
+
+    def step(self) -> None:
+        due = self.step_counter % self.update_rates == 0
+        threshold = self.step_threshold()
+        if due.any():
+            self.activity = evolve_volume(
+                self.alive,
+                self.stimulated,
+                self.topology,
+                due=due,
+                frontmost=self.frontmost_face.index,
+                threshold=threshold,
+                uniforms=self.draw_uniforms(),
+                rule_table=self.rule_table,
+            )
+        else:
+            self.activity = 0
+        self.step_counter += 1